@@ -1,22 +1,30 @@
+import time
+# Taken before anything else is imported, so the first run of a cold process
+# counts its imports.
+RUN_STARTED = time.perf_counter()
+
+import atexit
+import functools
+import hashlib
+import io
+import json
+import os
+import queue
 import streamlit as st
 import pandas as pd
-import math
-import time
-from datetime import datetime
+import tempfile
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
 
+import export
+import metrics
+import storage
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from bank import ALL_ITEMS, DEFAULT_BANK_BUY_PCT, ORIGINAL_ITEM_CATEGORIES, aggregates_frame, default_item_settings, deposits_frame, item_settings_from_data, parse_deposit_rows, payout_table, payout_tables_by_item, valuation_by_item, valuation_history
+
+metrics.REGISTRY.record_startup("imports", time.perf_counter() - RUN_STARTED)
 
-# --- FIREBASE INIT ---
-try:
-    import firebase_admin
-    from firebase_admin import credentials, firestore
-    if not firebase_admin._apps:
-        cred = credentials.Certificate(dict(st.secrets["firebase_json"]))
-        firebase_admin.initialize_app(cred)
-    db = firestore.client()
-    FIREBASE_OK = True
-except Exception as e:
-    st.error(f"Firebase Initialization FAILED: {e}")
-    FIREBASE_OK = False
 
 # --- CONFIG ---
 ADMIN_USERS = ["Diablo", "JESUS", "LT"]
@@ -27,27 +35,17 @@ ADMIN_PASSWORDS = {
 }
 SESSION_TIMEOUT = 15 * 60
 
-ORIGINAL_ITEM_CATEGORIES = {
-    "Waystones": [
-        "Waystone EXP + Delirious",
-        "Waystone EXP 35%",
-        "Waystone EXP"
-    ],
-    "White Item Bases": [
-        "Stellar Amulet",
-        "Breach ring level 82",
-        "Heavy Belt"
-    ],
-    "Tablets": [
-        "Tablet Exp 9%+10% (random)",
-        "Grand Project Tablet"
-    ],
-    "Various": [
-        "Logbook level 79-80"
-    ]
-}
-ALL_ITEMS = sum(ORIGINAL_ITEM_CATEGORIES.values(), [])
-DEFAULT_BANK_BUY_PCT = 80
+# "firestore" (default) or "sqlite". BANK_SQLITE_PATH=":memory:" runs a
+# throwaway bank entirely in-process.
+STORAGE_BACKEND = os.environ.get("BANK_STORAGE", "firestore")
+SQLITE_PATH = os.environ.get("BANK_SQLITE_PATH", "bank.sqlite3")
+# Admins who deposit in bursts can spread their Firestore totals over this
+# many shard documents, e.g. {"Diablo": 4}.
+ADMIN_TOTAL_SHARDS = {}
+# Admin logs older than LOG_RETENTION_DAYS are rolled into daily summaries;
+# the compactor checks every LOG_COMPACTION_INTERVAL seconds.
+LOG_RETENTION_DAYS = 30
+LOG_COMPACTION_INTERVAL = 6 * 60 * 60
 
 CATEGORY_COLORS = {
     "Waystones": "#FFD700",
@@ -79,7 +77,10 @@ def init_session():
         "login_failed": False,
         "deposit_in_progress": False,
         "admin_last_action": time.time(),
-        "show_reset_msg": None
+        "show_reset_msg": None,
+        # Names the session in run reports. Unlike the script run context's
+        # session id, it also tells apart AppTest sessions (loadtest.py).
+        "perf_session": uuid.uuid4().hex[:12]
     }
     for k, v in defaults.items():
         if k not in st.session_state:
@@ -99,184 +100,824 @@ def check_admin_timeout():
             st.warning("Admin session expired. Please log in again.")
 check_admin_timeout()
 
-# --- FIRESTORE HELPERS ---
+# --- PERFORMANCE ---
+def perf_run():
+    # This run's metrics.RunReport. Kept in the session rather than opened at
+    # the top of the script so on_click callbacks, which run first, count too.
+    ctx = get_script_run_ctx(suppress_warning=True)
+    if ctx is None:
+        return None
+    if "perf_run" not in st.session_state:
+        st.session_state["perf_run"] = metrics.RunReport(session=ss("perf_session") or ctx.session_id)
+    return st.session_state["perf_run"]
+
+def finish_perf_run(scope="app"):
+    report = perf_run()
+    del st.session_state["perf_run"]
+    st.session_state["full_run"] = False
+    report.scope = scope
+    if scope == "app":
+        report.record_phase("script", time.perf_counter() - RUN_STARTED)
+        metrics.REGISTRY.record_startup("first_run", report.phases["script"])
+    metrics.finish_run(report)
+
+def page_fragment(fn=None, admin=False):
+    # st.fragment for a page section. A fragment-only rerun never reaches
+    # finish_perf_run() at the bottom of the script, so the outermost
+    # fragment closes the report itself. Nor does it reach the script's
+    # check_admin_timeout(), so admin sections check it themselves and
+    # render nothing once the session has expired.
+    if fn is None:
+        return functools.partial(page_fragment, admin=admin)
+
+    @functools.wraps(fn)
+    def section(*args, **kwargs):
+        depth = ss("fragment_depth", 0)
+        st.session_state["fragment_depth"] = depth + 1
+        try:
+            if admin:
+                check_admin_timeout()
+            if not admin or ss('admin_logged', False):
+                fn(*args, **kwargs)
+        finally:
+            st.session_state["fragment_depth"] = depth
+        if depth == 0 and not ss("full_run", False):
+            finish_perf_run(scope=fn.__name__)
+    return st.fragment(section)
+
+def show_perf_panel():
+    report = perf_run()
+    summary = report.summary()
+    runs = metrics.REGISTRY.recent_runs()
+    with st.expander("⏱ Performance (admin only)", expanded=False):
+        colM1, colM2, colM3, colM4 = st.columns(4)
+        colM1.metric("Backend calls (this rerun)", summary["backend_calls"])
+        colM2.metric("Backend time", f"{summary['backend_ms']:.0f} ms")
+        colM3.metric("Documents", summary["docs"])
+        colM4.metric("Cache hits / misses", f"{summary['cache_hits']} / {summary['cache_misses']}")
+        startup = metrics.REGISTRY.startup_phases()
+        st.caption("Cold start of this server process: " + " · ".join(
+            f"{phase.replace('_', ' ')} {seconds * 1000:.0f} ms" for phase, seconds in startup.items()
+        ) + f" · setup on this rerun: {summary.get('setup_ms', 0):.0f} ms")
+        st.dataframe(report.rows(), hide_index=True, use_container_width=True)
+        st.write("**Recent reruns (this server process):**")
+        st.dataframe([r.summary() for r in reversed(runs)], hide_index=True, use_container_width=True)
+        colP1, colP2 = st.columns(2)
+        colP1.download_button("Prometheus metrics", metrics.REGISTRY.prometheus_text(),
+                              file_name="bank_metrics.prom", mime="text/plain", on_click="ignore")
+        colP2.download_button("Run reports (JSON lines)", "\n".join(json.dumps(r.as_dict()) for r in runs),
+                              file_name="bank_runs.jsonl", mime="application/json", on_click="ignore")
+
+metrics.set_run_resolver(perf_run)
+perf_run()
+st.session_state["full_run"] = True
+
+# --- STORAGE INIT ---
+@st.cache_resource
+def get_backend():
+    # Created once per process: the client, its credentials and, once warmed
+    # up, its connection are shared by every session and rerun. Every public
+    # backend call is timed and counted into the rerun's report.
+    started = time.perf_counter()
+    if STORAGE_BACKEND == "sqlite":
+        backend = storage.SQLiteBackend(SQLITE_PATH)
+    else:
+        backend = storage.FirestoreBackend.from_service_account(
+            dict(st.secrets["firebase_json"]), admin_total_shards=ADMIN_TOTAL_SHARDS
+        )
+    backend.warm_up()
+    metrics.REGISTRY.record_startup("backend", time.perf_counter() - started)
+    return metrics.InstrumentedBackend(backend)
+
+try:
+    backend = get_backend()
+except Exception as e:
+    st.error(f"Storage Initialization FAILED ({STORAGE_BACKEND}): {e}")
+    st.stop()
+
+# --- STORAGE HELPERS ---
 
 @st.cache_data(ttl=20)
-def get_item_settings():
-    if not FIREBASE_OK:
-        st.error("Firestore not initialized. Check your credentials and internet connection.")
-        return ({item: 100 for item in ALL_ITEMS}, {item: 0.0 for item in ALL_ITEMS}, DEFAULT_BANK_BUY_PCT)
+def _poll_item_settings(write_version):
+    # (version, settings): the fetch time doubles as the version. Keyed on
+    # LiveBankCache's write version, so this process's own writes are read
+    # back at once; the TTL bounds staleness from other processes.
+    metrics.cache_miss("item_settings")
     try:
-        settings_doc = db.collection("meta").document("item_settings").get()
-        targets = {item: 100 for item in ALL_ITEMS}
-        divines = {item: 0.0 for item in ALL_ITEMS}
-        bank_buy_pct = DEFAULT_BANK_BUY_PCT
-        if settings_doc.exists:
-            data = settings_doc.to_dict()
-            targets.update(data.get("targets", {}))
-            divines.update(data.get("divines", {}))
-            bank_buy_pct = data.get("bank_buy_pct", DEFAULT_BANK_BUY_PCT)
-        return targets, divines, bank_buy_pct
+        return ("poll", time.time()), item_settings_from_data(backend.load_item_settings())
     except Exception as e:
-        st.error(f"Error connecting to Firestore: {e}")
-        return ({item: 100 for item in ALL_ITEMS}, {item: 0.0 for item in ALL_ITEMS}, DEFAULT_BANK_BUY_PCT)
+        st.error(f"Error loading item settings: {e}")
+        return ("poll", time.time()), default_item_settings()
+
+@metrics.instrumented("item_settings", cached=True)
+def get_item_settings():
+    return live_bank_cache().item_settings()
 
+def _settings_changes(old, new):
+    # Only the values that changed, as {"old", "new"} pairs.
+    (old_targets, old_divines, old_pct), (new_targets, new_divines, new_pct) = old, new
+    changes = {}
+    for name, before, after in (("targets", old_targets, new_targets), ("divines", old_divines, new_divines)):
+        changed = {item: {"old": before.get(item), "new": value}
+                   for item, value in after.items() if before.get(item) != value}
+        if changed:
+            changes[name] = changed
+    if old_pct != new_pct:
+        changes["bank_buy_pct"] = {"old": old_pct, "new": new_pct}
+    return changes
+
+@metrics.instrumented("save_item_settings")
 def save_item_settings(targets, divines, bank_buy_pct):
-    if not FIREBASE_OK: return
     try:
-        db.collection("meta").document("item_settings").set({
-            "targets": targets,
-            "divines": divines,
-            "bank_buy_pct": bank_buy_pct
-        }, merge=True)
-        log_admin("Edit Targets/Values", f"Targets: {targets}, Divines: {divines}, Bank Buy %: {bank_buy_pct}")
+        changes = _settings_changes(get_item_settings(), (targets, divines, bank_buy_pct))
+        backend.save_item_settings(targets, divines, bank_buy_pct)
+        live_bank_cache().wrote("settings")
+        num_changed = len(changes.get("targets", {})) + len(changes.get("divines", {})) + ("bank_buy_pct" in changes)
+        log_admin("Edit Targets/Values", f"Changed {num_changed} settings", changes)
     except Exception as e:
         st.error(f"Error saving settings: {e}")
 
-def log_admin(action, details=""):
-    if not FIREBASE_OK: return
-    try:
-        db.collection("admin_logs").add({
-            "timestamp": datetime.utcnow(),
-            "admin_user": ss("admin_user", "unknown"),
-            "action": action,
-            "details": details
-        })
-    except Exception as e:
-        st.error(f"Error logging admin action: {e}")
+# --- ADMIN LOGS ---
+LOG_ACTIONS = [
+    "Admin Login", "Deposit Added", "Instant Sell Added", "Bulk Import", "Deleted deposits", "Deleted ALL deposits",
+    "Edit Targets/Values", "Reset Totals", "Rebuilt item aggregates",
+]
+LOG_PAGE_SIZE = 30
+# Admin logs are written off the request thread: AdminLogWriter commits what
+# was queued every LOG_FLUSH_INTERVAL seconds, as one batch.
+LOG_FLUSH_INTERVAL = 2.0
+LOG_QUEUE_MAX = 1000
+LOG_WRITE_ATTEMPTS = 5
+LOG_RETRY_BACKOFF = 0.5
+# Entries that failed every attempt, kept for the admin panel to retry.
+LOG_FAILED_KEEP = 1000
 
-def show_admin_logs(n=30):
-    if not FIREBASE_OK: return
+def admin_log_entry(action, details="", data=None):
+    # details is a one-line summary for people; data holds the structured fields.
+    return {
+        "timestamp": datetime.utcnow(),
+        "admin_user": ss("admin_user", "unknown"),
+        "action": action,
+        "details": details,
+        "data": data or {}
+    }
+
+class AdminLogWriter:
+    # Daemon thread committing queued admin logs in batches, retrying each
+    # batch with exponential backoff. Whatever is still queued when the
+    # process exits is flushed then. A full queue makes the caller flush
+    # instead of dropping entries.
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._queue = queue.Queue(maxsize=LOG_QUEUE_MAX)
+        # One batch in flight at a time, from the thread or a flush().
+        self._lock = threading.Lock()
+        self.failed = []
+        self.last_error = None
+        self.last_flush = None
+        self.written = 0
+        threading.Thread(target=self._run, name="admin-log-writer", daemon=True).start()
+        atexit.register(self.flush)
+
+    def put(self, entry):
+        item = (uuid.uuid4().hex[:20], entry)
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.flush()
+            self._queue.put(item)
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _run(self):
+        while True:
+            time.sleep(LOG_FLUSH_INTERVAL)
+            self.flush()
+
+    def _take(self, n):
+        items = []
+        while len(items) < n:
+            try:
+                items.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def _write(self, batch):
+        for attempt in range(LOG_WRITE_ATTEMPTS):
+            try:
+                self.backend.add_admin_logs(batch)
+            except Exception as e:
+                self.last_error = e
+                if attempt + 1 < LOG_WRITE_ATTEMPTS:
+                    time.sleep(LOG_RETRY_BACKOFF * 2 ** attempt)
+                continue
+            self.written += len(batch)
+            self.last_flush = datetime.now(timezone.utc)
+            return True
+        self.failed = (self.failed + batch)[-LOG_FAILED_KEEP:]
+        return False
+
+    def flush(self):
+        # Writes everything queued so far; False if some of it failed.
+        ok = True
+        with self._lock:
+            while True:
+                batch = self._take(storage.LOG_WRITE_CHUNK)
+                if not batch:
+                    return ok
+                ok = self._write(batch) and ok
+
+    def retry_failed(self):
+        with self._lock:
+            failed, self.failed = self.failed, []
+            for i, item in enumerate(failed):
+                try:
+                    self._queue.put_nowait(item)
+                except queue.Full:
+                    self.failed = failed[i:]
+                    break
+            self.last_error = None
+
+@st.cache_resource
+def admin_log_writer():
+    return AdminLogWriter(backend)
+
+@metrics.instrumented("log_admin")
+def log_admin(action, details="", data=None):
+    # Queued, so the page doesn't wait on the audit write.
+    admin_log_writer().put(admin_log_entry(action, details, data))
+
+def _log_frame(logs):
+    df = pd.DataFrame(logs, columns=["timestamp", "admin_user", "action", "details", "data"])
+    df["timestamp"] = pd.to_datetime(df["timestamp"], utc=True)
+    df["data"] = [json.dumps(d, default=str) if d else "" for d in df["data"]]
+    return df.rename(columns={"timestamp": "Timestamp", "admin_user": "Admin", "action": "Action",
+                              "details": "Details", "data": "Data"})
+
+@metrics.instrumented("show_admin_logs")
+def show_admin_logs():
+    if "logs_cursors" not in st.session_state:
+        _reset_pager("logs")
+    colL1, colL2, colL3 = st.columns(3)
+    log_admin_user = colL1.selectbox("Admin", ["All admins"] + ADMIN_USERS, key="logs_admin",
+                                     on_change=_reset_pager, args=("logs",))
+    log_action = colL2.selectbox("Action", ["All actions"] + LOG_ACTIONS, key="logs_action",
+                                 on_change=_reset_pager, args=("logs",))
+    log_dates = colL3.date_input("Date range (UTC)", value=(), key="logs_dates",
+                                 on_change=_reset_pager, args=("logs",))
+    since, until = _date_range_bounds(log_dates)
+    filters = dict(admin_user=None if log_admin_user == "All admins" else log_admin_user,
+                   action=None if log_action == "All actions" else log_action, since=since, until=until)
+    logs_cursors = st.session_state["logs_cursors"]
     try:
-        logs_ref = db.collection("admin_logs").order_by("timestamp", direction=firestore.Query.DESCENDING).limit(n).stream()
-        logs = [l.to_dict() for l in logs_ref]
-        if logs:
-            df = pd.DataFrame(logs)
-            df["timestamp"] = pd.to_datetime(df["timestamp"])
-            df = df.sort_values("timestamp", ascending=False)
-            df = df.rename(columns={"timestamp": "Timestamp", "admin_user": "Admin", "action": "Action", "details": "Details"})
-            st.dataframe(df, use_container_width=True, hide_index=True)
-        else:
-            st.info("No admin logs yet.")
+        logs, next_cursor = backend.page_admin_logs(page_size=LOG_PAGE_SIZE, cursor=logs_cursors[-1], **filters)
     except Exception as e:
         st.error(f"Could not load logs: {e}")
+        return
+    if logs:
+        st.dataframe(_log_frame(logs), use_container_width=True, hide_index=True)
+    else:
+        st.info("No admin logs match." if any(filters.values()) else "No admin logs yet.")
+    pager_controls("logs", next_cursor, f"{len(logs)} entries shown")
+    pending = admin_log_writer().pending()
+    if pending:
+        st.caption(f"{pending} newer entries are still being written.")
+
+    if st.toggle(f"Show daily summaries of logs older than {LOG_RETENTION_DAYS} days", key="logs_rollups"):
+        try:
+            rollups = backend.admin_log_rollups(since=since, until=until)
+        except Exception as e:
+            st.error(f"Could not load log summaries: {e}")
+            return
+        rollups = [r for r in rollups
+                   if r["admin_user"] == (filters["admin_user"] or r["admin_user"])
+                   and r["action"] == (filters["action"] or r["action"])]
+        compactor = log_compactor()
+        if compactor.last_error:
+            st.warning(f"Log compaction failed: {compactor.last_error}")
+        elif compactor.last_run:
+            st.caption(f"Last compaction: {compactor.last_run:%Y-%m-%d %H:%M} UTC, {compactor.last_compacted} logs rolled up.")
+        if rollups:
+            st.dataframe(pd.DataFrame(rollups).rename(columns={"day": "Day", "admin_user": "Admin",
+                                                               "action": "Action", "count": "Count"}),
+                         use_container_width=True, hide_index=True)
+        else:
+            st.info("No compacted logs match.")
+
+class LogCompactor:
+    # Daemon thread that rolls admin logs older than LOG_RETENTION_DAYS into
+    # daily summaries, keeping the admin_logs collection (and its query cost)
+    # bounded. Safe to run in several processes: compaction is transactional.
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.last_run = None
+        self.last_compacted = 0
+        self.last_error = None
+        threading.Thread(target=self._run, name="admin-log-compactor", daemon=True).start()
+
+    def _run(self):
+        while True:
+            try:
+                self.last_compacted = self.backend.compact_admin_logs(
+                    datetime.now(timezone.utc) - timedelta(days=LOG_RETENTION_DAYS)
+                )
+                self.last_error = None
+            except Exception as e:
+                self.last_error = e
+            self.last_run = datetime.now(timezone.utc)
+            time.sleep(LOG_COMPACTION_INTERVAL)
+
+@st.cache_resource
+def log_compactor():
+    return LogCompactor(backend)
 
+@metrics.instrumented("get_admin_totals")
 def get_admin_totals(admin_user):
-    if not FIREBASE_OK: return 0.0, 0.0
-    doc = db.collection("admin_totals").document(admin_user).get()
-    if doc.exists:
-        data = doc.to_dict()
-        return data.get("total_normal_value", 0.0), data.get("total_instant_value", 0.0)
-    else:
-        return 0.0, 0.0
-
-def update_admin_totals(admin_user, normal_add=0.0, instant_add=0.0):
-    if not FIREBASE_OK: return
-    norm, inst = get_admin_totals(admin_user)
-    db.collection("admin_totals").document(admin_user).set({
-        "total_normal_value": norm + normal_add,
-        "total_instant_value": inst + instant_add
-    })
+    return backend.get_admin_totals(admin_user)
 
+@metrics.instrumented("reset_admin_totals")
 def reset_admin_totals(admin_user):
-    if not FIREBASE_OK: return
-    norm, inst = get_admin_totals(admin_user)
-    db.collection("admin_totals").document(admin_user).set({
-        "total_normal_value": 0.0,
-        "total_instant_value": 0.0
-    })
-    log_admin("Reset Totals", f"Admin: {admin_user} | Before Reset: Normal = {norm:.3f} Div, Instant = {inst:.3f} Div")
+    # (normal, instant) before the reset, or None if it failed.
+    try:
+        norm, inst = backend.reset_admin_totals(admin_user)
+    except Exception as e:
+        st.error(f"Error resetting admin totals: {e}")
+        return None
+    log_admin("Reset Totals", f"Before reset: Normal = {norm:.3f} Div, Instant = {inst:.3f} Div",
+              {"admin_user": admin_user, "normal_before": norm, "instant_before": inst})
+    return norm, inst
+
+# --- ITEM AGGREGATES ---
+# Per-item running totals (total_qty, total_value and per-user quantities)
+# that the public overview renders from. Every ledger write updates them in
+# the same transaction.
+
+def _empty_aggregate(item):
+    return {"item": item, "total_qty": 0, "total_value": 0.0, "users": {}}
 
-def add_instant_sell(admin_user, item, qty, value):
-    if not FIREBASE_OK: return False
+def _with_all_items(aggregates):
+    merged = {item: _empty_aggregate(item) for item in ALL_ITEMS}
+    merged.update(aggregates)
+    return merged
+
+@st.cache_data(ttl=20)
+def _poll_item_aggregates(write_version):
+    # (version, aggregates): the fetch time doubles as the version.
+    metrics.cache_miss("item_aggregates")
     try:
-        doc_ref = db.collection("instant_sells").document(admin_user)
-        doc_ref.collection("entries").add({
-            "item": item,
-            "qty": qty,
-            "value": value,
-            "timestamp": datetime.utcnow()
-        })
-        update_admin_totals(admin_user, normal_add=0.0, instant_add=value * qty)
-        log_admin("Instant Sell Added", f"{admin_user}: {qty}x {item} (Value per: {value:.3f} Div)")
-        return True
+        return ("poll", time.time()), _with_all_items(backend.item_aggregates())
     except Exception as e:
-        st.error(f"Error adding instant sell: {e}")
-        return False
+        st.error(f"Error loading item totals: {e}")
+        return ("poll", time.time()), _with_all_items({})
+
+@metrics.instrumented("item_aggregates", cached=True)
+def get_item_aggregates():
+    return live_bank_cache().item_aggregates()
+
+@st.cache_resource(max_entries=4)
+def _payout_tables(aggregates_version, settings_version, _aggregates, _targets, _divines):
+    # Keyed on the data versions only; shared read-only by every session.
+    metrics.cache_miss("payout_tables")
+    return payout_tables_by_item(payout_table(aggregates_frame(_aggregates), _targets, _divines))
+
+@metrics.instrumented("payout_tables", cached=True)
+def get_payout_tables():
+    cache = live_bank_cache()
+    aggregates_version, aggregates = cache.item_aggregates_snapshot()
+    settings_version, (targets, divines, _) = cache.item_settings_snapshot()
+    return _payout_tables(aggregates_version, settings_version, aggregates, targets, divines)
 
-def add_normal_deposit(user, admin_user, item, qty, value):
-    if not FIREBASE_OK: return False
+@metrics.instrumented("rebuild_item_aggregates")
+def rebuild_item_aggregates():
+    num_deposits = backend.rebuild_item_aggregates(ALL_ITEMS)
+    live_bank_cache().wrote("aggregates")
+    log_admin("Rebuilt item aggregates", f"Recomputed {len(ALL_ITEMS)} items from {num_deposits} deposits",
+              {"items": len(ALL_ITEMS), "deposits": num_deposits})
+    return num_deposits
+
+# --- LEDGER TOTALS ---
+# Per-item deposit counts and quantities computed from the ledger itself
+# (server-side count()/sum() on Firestore), independent of item_aggregates.
+# Cached until this process writes to the ledger; the TTL bounds how stale
+# writes from other processes can leave it.
+@st.cache_data(ttl=300, show_spinner="Aggregating the ledger…")
+def _ledger_item_totals():
+    metrics.cache_miss("ledger_totals")
     try:
-        doc_ref = db.collection("users").document(user)
-        doc_ref.set({}, merge=True)
-        deposits_ref = doc_ref.collection("deposits")
-        dep = {
-            "item": item,
-            "qty": qty,
-            "value": value,
-            "timestamp": datetime.utcnow()
-        }
-        deposits_ref.add(dep)
-        update_admin_totals(admin_user, normal_add=value * qty, instant_add=0.0)
-        log_admin("Deposit Added", f"{admin_user}: {qty}x {item} for {user} (Value per: {value:.3f} Div)")
-        return True
+        return backend.ledger_item_totals(ALL_ITEMS)
     except Exception as e:
-        st.error(f"Error adding deposit: {e}")
-        return False
+        st.error(f"Error aggregating the ledger: {e}")
+        return None
+
+@metrics.instrumented("ledger_totals", cached=True)
+def get_ledger_item_totals():
+    return _ledger_item_totals()
+
+def ledger_changed():
+    # After every ledger write of this process, so its readers see it at once.
+    _ledger_item_totals.clear()
+    live_bank_cache().wrote("aggregates")
+
+def item_totals_check():
+    # Overview totals (item_aggregates) next to the ledger's, per item.
+    ledger = get_ledger_item_totals()
+    if ledger is None:
+        return None
+    aggregates = get_item_aggregates()
+    check = pd.DataFrame([{
+        "Item": item,
+        "Overview total": aggregates[item]["total_qty"],
+        "Ledger total": ledger[item]["total_qty"],
+        "Deposits": ledger[item]["count"],
+    } for item in ALL_ITEMS])
+    check["Drift"] = check["Overview total"] - check["Ledger total"]
+    return check
+
+# --- VALUE HISTORY ---
+# Daily per-item rollups of the ledger and saved price versions, both small,
+# so the value chart never reads the deposits themselves. Keyed on this
+# process's write versions like the polled loaders.
+VALUE_HISTORY_RANGES = {"30 days": 30, "90 days": 90, "All": None}
 
-def delete_deposit(user, deposit_id):
-    if not FIREBASE_OK: return
+@st.cache_data(ttl=60)
+def _deposit_rollups(write_version):
+    metrics.cache_miss("deposit_rollups")
     try:
-        db.collection("users").document(user).collection("deposits").document(deposit_id).delete()
-        log_admin("Deleted deposit", f"User: {user}, Deposit ID: {deposit_id}")
-        st.success("Deposit deleted!")
-        st.rerun()
+        return backend.deposit_rollups()
     except Exception as e:
-        st.error(f"Failed to delete deposit: {e}")
-
-@st.cache_data(ttl=20, show_spinner="Loading all deposits…")
-def get_all_deposits():
-    if not FIREBASE_OK:
-        return pd.DataFrame(columns=["user", "item", "qty", "timestamp", "value", "id"])
-    users_ref = db.collection("users").stream()
-    all_deps = []
-    for u in users_ref:
-        user_id = u.id
-        deps = db.collection("users").document(user_id).collection("deposits").stream()
-        for dep in deps:
-            d = dep.to_dict()
-            d["user"] = user_id
-            d["id"] = dep.id
-            all_deps.append(d)
-    if not all_deps:
-        return pd.DataFrame(columns=["user", "item", "qty", "timestamp", "value", "id"])
-    df = pd.DataFrame(all_deps)
-    for col in ["user", "item", "qty", "timestamp", "value", "id"]:
-        if col not in df.columns:
-            df[col] = None
-    if "timestamp" in df:
-        df["timestamp"] = pd.to_datetime(df["timestamp"], errors="coerce")
-    df["qty"] = pd.to_numeric(df["qty"], errors="coerce").fillna(0).astype(int)
-    return df
+        st.error(f"Error loading deposit history: {e}")
+        return []
 
-# --------- NEW: DELETE ALL DEPOSITS FOR ITEM (ADMIN TOOL) ---------
-def delete_all_deposits_for_item(item):
-    if not FIREBASE_OK:
+@metrics.instrumented("deposit_rollups", cached=True)
+def get_deposit_rollups():
+    return _deposit_rollups(live_bank_cache().write_version("aggregates"))
+
+@st.cache_data(ttl=300)
+def _item_settings_history(write_version):
+    metrics.cache_miss("item_settings_history")
+    try:
+        return backend.item_settings_history()
+    except Exception as e:
+        st.error(f"Error loading price history: {e}")
+        return []
+
+@metrics.instrumented("item_settings_history", cached=True)
+def get_item_settings_history():
+    return _item_settings_history(live_bank_cache().write_version("settings"))
+
+# --- DEPOSIT SUBMISSION ---
+
+@metrics.instrumented("submit_deposits")
+def submit_deposits(user, admin_user, item_values, instant_sell, submission_id):
+    # Commits one "Add Deposit(s)" click atomically: every ledger entry, the
+    # item aggregates, one combined admin-total increment and one admin_logs
+    # entry. item_values maps item -> (qty, value_per). Replaying a
+    # submission_id returns "duplicate" and writes nothing.
+    lines = [f"{qty}x {item} (Value per: {value:.3f} Div)" for item, (qty, value) in item_values.items()]
+    total_value = sum(qty * value for qty, value in item_values.values())
+    if instant_sell:
+        action, target = "Instant Sell Added", ""
+    else:
+        action, target = "Deposit Added", f" for {user}"
+    log_entry = admin_log_entry(action, f"{admin_user}: {', '.join(lines)}{target} | Total: {total_value:.3f} Div", {
+        "user": None if instant_sell else user,
+        "items": {item: {"qty": qty, "value_per": value} for item, (qty, value) in item_values.items()},
+        "total_value": total_value
+    })
+    try:
+        status = backend.submit_deposits(user, admin_user, item_values, instant_sell, submission_id, log_entry)
+    except Exception as e:
+        st.error(f"Error adding deposit(s): {e}")
+        return "failed"
+    if status == "added":
+        ledger_changed()
+    return status
+
+def _submit_deposit_form():
+    # on_click callback: runs before the rerun, so it may reset the inputs.
+    # It also runs before the script's own timeout check, so check here.
+    check_admin_timeout()
+    if not ss('admin_logged', False):
+        return
+    item_qtys = {item: ss(f"add_{item}", 0) for item in ALL_ITEMS}
+    item_qtys = {item: qty for item, qty in item_qtys.items() if qty > 0}
+    user = (ss("deposit_user", "") or "").strip()
+    instant_sell = ss("instantsell_check", False)
+    if not item_qtys:
+        st.session_state["deposit_msg"] = ("info", "Nothing to add: all quantities are 0.")
+        return
+    if not instant_sell and not user:
+        st.session_state["deposit_msg"] = ("error", "Please enter a user for normal deposits, or check instant sell for admin-only.")
         return
-    users_ref = db.collection("users").stream()
-    num_deleted = 0
-    for u in users_ref:
-        user_id = u.id
-        deps = db.collection("users").document(user_id).collection("deposits").stream()
-        for dep in deps:
-            d = dep.to_dict()
-            if d.get("item") == item:
-                db.collection("users").document(user_id).collection("deposits").document(dep.id).delete()
-                num_deleted += 1
-    log_admin("Deleted ALL deposits", f"Item: {item} | Deleted {num_deleted} deposits")
-    st.success(f"Deleted {num_deleted} deposits for item: {item}")
+    targets, divines, _ = get_item_settings()
+    item_values = {item: (qty, divines.get(item, 0.0) / targets.get(item, 1)) for item, qty in item_qtys.items()}
+    status = submit_deposits(user, ss('admin_user'), item_values, instant_sell, st.session_state["deposit_submission_id"])
+    if status == "failed":
+        return
+    # Clearing the inputs and issuing a new id means a second click on the
+    # same button is a no-op rather than a second copy of the submission.
+    for item in ALL_ITEMS:
+        st.session_state[f"add_{item}"] = 0
+    st.session_state["deposit_submission_id"] = uuid.uuid4().hex
+    if status == "duplicate":
+        st.session_state["deposit_msg"] = ("info", "This submission was already recorded; nothing was added twice.")
+    else:
+        st.session_state["deposit_msg"] = ("success", "Deposits processed!")
+    update_admin_action()
+    # Totals, overview and logs all changed, not just this fragment.
     st.rerun()
 
+# --- BULK IMPORT ---
+def import_id_for(admin_user, rows, attempt_id):
+    # Scoped to one import attempt (attempt_id, kept in the session until an
+    # import succeeds) and its rows: retrying an interrupted import skips the
+    # chunks that landed, while importing the same rows again later, as
+    # repeat trades do, adds them again.
+    key = json.dumps([admin_user, attempt_id] + [[r["user"], r["item"], r["qty"]] for r in rows])
+    return hashlib.sha256(key.encode()).hexdigest()[:32]
+
+@metrics.instrumented("import_deposits")
+def import_deposits(rows, progress=None):
+    # rows: parse_deposit_rows() rows with value_per filled in. Returns
+    # (num_added, num_skipped), or None if the import failed; one summary
+    # admin_logs entry covers the whole import.
+    admin_user = ss("admin_user")
+    if "import_attempt_id" not in st.session_state:
+        st.session_state["import_attempt_id"] = uuid.uuid4().hex
+    import_id = import_id_for(admin_user, rows, st.session_state["import_attempt_id"])
+    deposits = [(r["user"], r["item"], r["qty"], r["value_per"]) for r in rows]
+    try:
+        added, skipped = backend.import_deposits(admin_user, deposits, import_id, progress=progress)
+    except Exception as e:
+        st.error(f"Import stopped: {e}. Chunks already written are kept; run the same import again to add the rest.")
+        return None
+    if added:
+        ledger_changed()
+    by_item = {}
+    for r in rows:
+        by_item[r["item"]] = by_item.get(r["item"], 0) + r["qty"]
+    total_value = sum(r["qty"] * r["value_per"] for r in rows)
+    num_users = len({r["user"] for r in rows})
+    log_admin("Bulk Import", f"{added} deposits for {num_users} users | Total: {total_value:.3f} Div", {
+        "import_id": import_id,
+        "rows": len(rows),
+        "added": added,
+        "skipped": skipped,
+        "users": num_users,
+        "by_item": by_item,
+        "total_value": total_value
+    })
+    return added, skipped
+
+@metrics.instrumented("delete_deposits")
+def delete_deposits(keys):
+    # keys: [(user, deposit_id)]; one batched backend call and one log entry.
+    try:
+        num_deleted = backend.delete_deposits(keys)
+    except Exception as e:
+        st.error(f"Failed to delete deposits: {e}")
+        return 0
+    if num_deleted:
+        ledger_changed()
+    log_admin("Deleted deposits", f"Deleted {num_deleted} of {len(keys)} selected deposits",
+              {"deposits": [{"user": user, "id": deposit_id} for user, deposit_id in keys], "deleted": num_deleted})
+    return num_deleted
+
+# --- PAGING ---
+# A pager is a stack of backend cursors in the session, under "{name}_cursors";
+# the last one fetches the page being shown.
+def _reset_pager(name):
+    # Filter changes start again from page one. Bumping the generation gives
+    # keyed widgets (e.g. a selectable grid) a fresh key, which also drops the
+    # old row selection.
+    st.session_state[f"{name}_cursors"] = [None]
+    st.session_state[f"{name}_generation"] = ss(f"{name}_generation", 0) + 1
+
+def _pager_next(name, cursor):
+    st.session_state[f"{name}_cursors"].append(cursor)
+    st.session_state[f"{name}_generation"] = ss(f"{name}_generation", 0) + 1
+
+def _pager_prev(name):
+    if len(st.session_state[f"{name}_cursors"]) > 1:
+        st.session_state[f"{name}_cursors"].pop()
+    st.session_state[f"{name}_generation"] = ss(f"{name}_generation", 0) + 1
+
+def pager_controls(name, next_cursor, caption):
+    cursors = st.session_state[f"{name}_cursors"]
+    colN1, colN2, colN3 = st.columns([1, 1, 2])
+    colN1.button("◀ Prev", key=f"{name}_prev_btn", disabled=len(cursors) == 1, on_click=_pager_prev, args=(name,))
+    colN2.button("Next ▶", key=f"{name}_next_btn", disabled=next_cursor is None,
+                 on_click=_pager_next, args=(name, next_cursor))
+    colN3.caption(f"Page {len(cursors)} · {caption}")
+
+def _date_range_bounds(date_range):
+    # st.date_input range -> [since, until) in UTC, or (None, None).
+    if not date_range:
+        return None, None
+    since = datetime.combine(date_range[0], datetime.min.time(), tzinfo=timezone.utc)
+    until = datetime.combine(date_range[-1], datetime.min.time(), tzinfo=timezone.utc) + timedelta(days=1)
+    return since, until
+
+# --- DEPOSIT BROWSER ---
+BROWSER_PAGE_SIZES = [25, 50, 100, 250]
+
+@metrics.instrumented("browse_deposits")
+def browse_deposits(item, user, date_range, newest_first, page_size, cursor):
+    since, until = _date_range_bounds(date_range)
+    try:
+        return backend.page_deposits(item=item, user=user or None, since=since, until=until,
+                                     newest_first=newest_first, page_size=page_size, cursor=cursor)
+    except Exception as e:
+        st.error(f"Error loading deposits: {e}")
+        return [], None
+
+# --- EXPORT ---
+EXPORT_LABELS = {"deposits": "Deposits ledger", "instant_sells": "Instant sells",
+                 "payouts": "Payouts per item", "settlements": "Settlement per user"}
+# Exports larger than this spill from memory to a temp file while written.
+EXPORT_SPOOL_BYTES = 16 * 1024 * 1024
+
+def export_file(what, fmt):
+    # Called by the download button on click, off the script thread: the
+    # export streams page by page into a spooled temp file, and only the
+    # finished file is read back to be served.
+    with tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_BYTES) as f:
+        if fmt == "csv":
+            text = io.TextIOWrapper(f, encoding="utf-8", newline="")
+            export.export(backend, what, "csv", text)
+            text.flush()
+            text.detach()
+        else:
+            export.export(backend, what, "parquet", f)
+        f.seek(0)
+        return f.read()
+
+# --- LIVE CACHE ---
+# How long a fresh subscription may take to deliver its first snapshot
+# before readers fall back to polling.
+LISTENER_STARTUP_TIMEOUT = 10
+# How often a dropped listener is re-subscribed while readers poll.
+LISTENER_RETRY_INTERVAL = 60
+# After this process writes, aggregates and settings are read from the
+# backend until the listener delivers a snapshot, for at most this long (a
+# write that changed nothing never produces one).
+WRITE_CATCH_UP_WINDOW = 10
+
+class LiveBankCache:
+    # Process-wide in-memory view of the item aggregates and item settings,
+    # kept current by the backend's change listeners. The ledger itself is
+    # not mirrored: pages, totals and exports read it from the backend.
+    # Every session reads the same objects at zero read cost. While a listener is
+    # down, or on backends without listeners, readers fall back to the polled
+    # st.cache_data loaders. Writes made by this process call wrote(), so
+    # the writer reads them back on its very next rerun either way.
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        # Separate from _lock: unsubscribing may wait on a callback that is
+        # itself waiting for _lock.
+        self._subscribe_lock = threading.Lock()
+        self.last_error = None
+        self.push_supported = True
+        self._aggregates = {}
+        self._settings = None
+        self._versions = {"aggregates": 0, "settings": 0}
+        # Bumped by wrote(); the polled loaders are keyed on it.
+        self._write_versions = {"aggregates": 0, "settings": 0}
+        self._wrote_at = {}
+        self._ready = {name: threading.Event() for name in ("aggregates", "settings")}
+        self._watches = {}
+        self._subscribed_at = 0.0
+        self._subscribe()
+
+    def _subscribe(self):
+        for watch in self._watches.values():
+            try:
+                watch.unsubscribe()
+            except Exception:
+                pass
+        self._watches = {}
+        for ready in self._ready.values():
+            ready.clear()
+        self._subscribed_at = time.time()
+        try:
+            watch = backend.watch_item_aggregates(self._on_aggregates)
+            if watch is None:
+                self.push_supported = False
+                return
+            self._watches["aggregates"] = watch
+            self._watches["settings"] = backend.watch_item_settings(self._on_settings)
+        except Exception as e:
+            self.last_error = e
+
+    # Listener callbacks run on the backend's watch threads.
+
+    def _on_aggregates(self, aggregates):
+        with self._lock:
+            self._aggregates = aggregates
+            self._versions["aggregates"] += 1
+            self._wrote_at.pop("aggregates", None)
+        self._ready["aggregates"].set()
+
+    def _on_settings(self, data):
+        with self._lock:
+            self._settings = item_settings_from_data(data)
+            self._versions["settings"] += 1
+            self._wrote_at.pop("settings", None)
+        self._ready["settings"].set()
+
+    def _live(self, name):
+        if not self.push_supported:
+            return False
+        watch = self._watches.get(name)
+        if watch is None or not watch.is_active:
+            with self._subscribe_lock:
+                if time.time() - self._subscribed_at > LISTENER_RETRY_INTERVAL:
+                    self._subscribe()
+            return False
+        # Only block while a fresh subscription is still starting up.
+        wait = LISTENER_STARTUP_TIMEOUT - (time.time() - self._subscribed_at)
+        return self._ready[name].wait(max(wait, 0))
+
+    def wrote(self, *names):
+        # This process just wrote to these: the polled loaders miss on their
+        # next call, and live readers use them until the listener catches up.
+        with self._lock:
+            for name in names:
+                self._write_versions[name] += 1
+                self._wrote_at[name] = time.time()
+
+    def _caught_up(self, name):
+        with self._lock:
+            wrote_at = self._wrote_at.get(name)
+        return wrote_at is None or time.time() - wrote_at > WRITE_CATCH_UP_WINDOW
+
+    def write_version(self, name):
+        with self._lock:
+            return self._write_versions[name]
+
+    def down_listeners(self):
+        if not self.push_supported:
+            return []
+        return [name for name in self._ready
+                if self._watches.get(name) is None or not self._watches[name].is_active]
+
+    # The *_snapshot readers return (version, data); the version changes
+    # whenever the data may have, so derived tables can be cached on it.
+
+    def item_aggregates_snapshot(self):
+        if not self._live("aggregates") or not self._caught_up("aggregates"):
+            return _poll_item_aggregates(self.write_version("aggregates"))
+        with self._lock:
+            return ("live", self._subscribed_at, self._versions["aggregates"]), _with_all_items(self._aggregates)
+
+    def item_aggregates(self):
+        return self.item_aggregates_snapshot()[1]
+
+    def item_settings_snapshot(self):
+        if not self._live("settings") or not self._caught_up("settings"):
+            return _poll_item_settings(self.write_version("settings"))
+        with self._lock:
+            targets, divines, bank_buy_pct = self._settings
+            return ("live", self._subscribed_at, self._versions["settings"]), (dict(targets), dict(divines), bank_buy_pct)
+
+    def item_settings(self):
+        return self.item_settings_snapshot()[1]
+
+@st.cache_resource
+def live_bank_cache():
+    return LiveBankCache()
+
+# --------- NEW: DELETE ALL DEPOSITS FOR ITEM (ADMIN TOOL) ---------
+@metrics.instrumented("delete_all_deposits_for_item")
+def delete_all_deposits_for_item(item, dry_run=False, progress=None):
+    # Returns (num_matched, num_deleted, archive_id); progress(done, total) is
+    # called after each chunk. Deleted rows are archived first.
+    try:
+        matched, deleted, archive_id = backend.delete_item_deposits(
+            item, ss("admin_user", "unknown"), dry_run=dry_run, progress=progress
+        )
+    except storage.ArchiveFailed as e:
+        st.error(str(e))
+        return e.num_matched, 0, None
+    if not dry_run and deleted:
+        ledger_changed()
+    if not dry_run and matched:
+        details = f"Item: {item} | Deleted {deleted} deposits | Archive: {archive_id}"
+        if deleted < matched:
+            details += f" | {matched - deleted} failed"
+        log_admin("Deleted ALL deposits", details,
+                  {"item": item, "matched": matched, "deleted": deleted, "archive_id": archive_id})
+    return matched, deleted, archive_id
+
+log_compactor()
+# Everything above runs on every full rerun, before any of the page renders.
+perf_run().record_phase("setup", time.perf_counter() - RUN_STARTED)
+
 # --- LOGIN HANDLING ---
 col1, col2, col3 = st.columns([1,2,1])
 with col2:
@@ -306,7 +947,7 @@ if ss('show_login', False) and not ss('admin_logged', False):
                 st.session_state['admin_user'] = uname
                 st.session_state['show_login'] = False
                 st.success("Login success! Press the login button again to confirm.")
-                log_admin("Admin Login", f"Admin {uname} logged in.")
+                log_admin("Admin Login", f"Admin {uname} logged in.", {"admin_user": uname})
                 update_admin_action()
             else:
                 st.session_state['login_failed'] = True
@@ -314,12 +955,27 @@ if ss('show_login', False) and not ss('admin_logged', False):
 
 if ss('admin_logged', False):
     st.caption(f"**Admin mode enabled: {ss('admin_user','')}**")
+    down = live_bank_cache().down_listeners()
+    if down:
+        last_error = live_bank_cache().last_error
+        st.warning(f"Live updates unavailable for {', '.join(down)}; polling every 20s instead."
+                   + (f" Last error: {last_error}" if last_error else ""))
+    log_writer = admin_log_writer()
+    if log_writer.failed:
+        st.warning(f"{len(log_writer.failed)} admin log entries could not be written after "
+                   f"{LOG_WRITE_ATTEMPTS} attempts. Last error: {log_writer.last_error}")
+        if st.button("Retry writing admin logs", key="retry_admin_logs_btn"):
+            log_writer.retry_failed()
+            st.rerun()
 else:
     st.caption("**Read only mode** (progress & deposit info only)")
 
 # ----------- ADMIN PANEL -------------
-if ss('admin_logged', False):
-    st.header("🔑 Admin Panel Overview")
+# Each section is a fragment: its widgets rerun only that section and its own
+# reads. Actions that change what other sections show end in st.rerun(),
+# which reruns the whole page.
+@page_fragment(admin=True)
+def admin_totals_section():
     norm_val, inst_val = get_admin_totals(ss('admin_user'))
     combined_val = norm_val + inst_val
 
@@ -330,47 +986,99 @@ if ss('admin_logged', False):
     colC.metric("Combined Total", f"{combined_val:.3f} Div")
 
     if st.button("⚠️ Reset My Admin Totals (no undo)"):
-        reset_admin_totals(ss('admin_user'))
-        st.session_state['show_reset_msg'] = f"Your admin totals have been reset. (Before reset → Normal: {norm_val:.3f} Div, Instant: {inst_val:.3f} Div)"
-        st.rerun()
+        before = reset_admin_totals(ss('admin_user'))
+        if before is not None:
+            norm_before, inst_before = before
+            st.session_state['show_reset_msg'] = f"Your admin totals have been reset. (Before reset → Normal: {norm_before:.3f} Div, Instant: {inst_before:.3f} Div)"
+            st.rerun(scope="fragment")
     if ss('show_reset_msg', None):
         st.success(st.session_state.pop('show_reset_msg'))
 
-    st.markdown("---")
-
+@page_fragment(admin=True)
+def add_deposit_section():
     st.subheader("Add Deposit or Instant Sell (admin-only)")
-    user = st.text_input("User (for deposit, leave blank for instant sell)", key="deposit_user")
+    st.text_input("User (for deposit, leave blank for instant sell)", key="deposit_user")
     col1, col2 = st.columns(2)
-    item_qtys = {}
     for i, item in enumerate(ALL_ITEMS):
         col = col1 if i % 2 == 0 else col2
-        item_qtys[item] = col.number_input(
+        col.number_input(
             f"{item}",
             min_value=0,
             step=1,
             key=f"add_{item}"
         )
-    instant_sell = st.checkbox("Add as Instant Sell (not visible to users)", key="instantsell_check")
-    if st.button("Add Deposit(s)", key="add_deposit_btn"):
-        targets, divines, _ = get_item_settings()
-        added_any = False
-        for item, qty in item_qtys.items():
-            if qty > 0:
-                value_per = divines.get(item, 0.0) / targets.get(item, 1)
-                if instant_sell:
-                    add_instant_sell(ss('admin_user'), item, qty, value_per)
-                    added_any = True
-                else:
-                    if user.strip() == "":
-                        st.error("Please enter a user for normal deposits, or check instant sell for admin-only.")
-                        continue
-                    add_normal_deposit(user.strip(), ss('admin_user'), item, qty, value_per)
-                    added_any = True
-        if added_any:
-            st.success("Deposits processed!")
+    st.checkbox("Add as Instant Sell (not visible to users)", key="instantsell_check")
+    if "deposit_submission_id" not in st.session_state:
+        st.session_state["deposit_submission_id"] = uuid.uuid4().hex
+    st.button("Add Deposit(s)", key="add_deposit_btn", on_click=_submit_deposit_form)
+    if ss('deposit_msg', None):
+        kind, msg = st.session_state.pop('deposit_msg')
+        getattr(st, kind)(msg)
 
-    st.markdown("---")
+@page_fragment(admin=True)
+def bulk_import_section():
+    st.subheader("Bulk Import Deposits (admin only)")
+    st.caption("One deposit per row: user, item, qty. Comma, semicolon or tab separated; the header row is "
+               "optional and item names may be abbreviated or slightly misspelled.")
+    if ss('import_msg', None):
+        kind, msg = st.session_state.pop('import_msg')
+        getattr(st, kind)(msg)
+    # A new generation gives the inputs fresh keys, which clears them.
+    generation = ss("import_generation", 0)
+    uploaded = st.file_uploader("CSV file", type=["csv", "tsv", "txt"], key=f"import_file_{generation}")
+    pasted = st.text_area("…or paste rows", key=f"import_text_{generation}", height=150)
+    text = pasted
+    if uploaded:
+        # Excel on Windows saves CSV as cp1252 unless told otherwise.
+        raw = uploaded.getvalue()
+        try:
+            text = raw.decode("utf-8-sig")
+        except UnicodeDecodeError:
+            try:
+                text = raw.decode("cp1252")
+            except UnicodeDecodeError:
+                st.error("Could not read the file; save it as UTF-8 CSV and upload it again.")
+                return
+    if not text.strip():
+        return
+    rows, errors = parse_deposit_rows(text)
+    targets, divines, _ = get_item_settings()
+    for r in rows:
+        r["value_per"] = divines.get(r["item"], 0.0) / targets.get(r["item"], 1)
+    if rows:
+        preview = pd.DataFrame(rows)
+        preview["value"] = preview["qty"] * preview["value_per"]
+        st.dataframe(
+            preview[["line", "user", "typed_item", "item", "qty", "value_per", "value"]].rename(columns={
+                "line": "Line", "user": "User", "typed_item": "Typed item", "item": "Item", "qty": "Qty",
+                "value_per": "Value per (Div)", "value": "Value (Div)"
+            }),
+            hide_index=True, use_container_width=True
+        )
+        st.caption(f"{len(rows)} deposits for {preview['user'].nunique()} users, "
+                   f"total {preview['value'].sum():.3f} Div")
+    if errors:
+        st.warning(f"{len(errors)} rows will be skipped:")
+        st.dataframe(pd.DataFrame(errors, columns=["Line", "Problem"]), hide_index=True, use_container_width=True)
+    if rows and st.button(f"Import {len(rows)} deposits", key="import_btn"):
+        bar = st.progress(0.0, text="Importing deposits…")
+        result = import_deposits(
+            rows, progress=lambda done, total: bar.progress(done / total, text=f"Imported {done}/{total} deposits")
+        )
+        if result is not None:
+            added, skipped = result
+            update_admin_action()
+            st.session_state["import_generation"] = generation + 1
+            # The next import is a new attempt, even with the same rows.
+            del st.session_state["import_attempt_id"]
+            if skipped:
+                st.session_state["import_msg"] = ("info", f"Imported {added} deposits; {skipped} were already written by the interrupted attempt and were skipped.")
+            else:
+                st.session_state["import_msg"] = ("success", f"Imported {added} deposits.")
+            st.rerun()
 
+@page_fragment(admin=True)
+def edit_targets_section():
     st.subheader("Edit Per-Item Targets, Values, Bank Buy %")
     targets, divines, bank_buy_pct = get_item_settings()
     with st.form("edit_targets_form"):
@@ -396,9 +1104,9 @@ if ss('admin_logged', False):
             save_item_settings(new_targets, new_divines, bank_buy_pct_new)
             st.success("Saved!")
             st.rerun()
-    st.markdown("---")
 
-    # ----------- DELETE ALL DEPOSITS ADMIN TOOL -------------
+@page_fragment(admin=True)
+def delete_all_section():
     st.subheader("⚠️ Delete All Deposits For An Item (admin only)")
     item_to_delete = st.selectbox(
         "Select item to delete all deposits for:",
@@ -412,151 +1120,285 @@ if ss('admin_logged', False):
         st.session_state["pending_delete_item"] = item_to_delete
 
     if st.session_state.get("pending_delete_item"):
-        st.error(f"Confirm: Delete ALL deposits for [{st.session_state['pending_delete_item']}]?")
-        colD1, colD2 = st.columns(2)
+        pending_item = st.session_state["pending_delete_item"]
+        st.error(f"Confirm: Delete ALL deposits for [{pending_item}]?")
+        colD1, colD2, colD3 = st.columns(3)
         if colD1.button("CONFIRM DELETE (NO UNDO)", key="confirm_delete_all_deps_btn"):
-            delete_all_deposits_for_item(st.session_state["pending_delete_item"])
+            bar = st.progress(0.0, text="Deleting deposits…")
+            matched, deleted, archive_id = delete_all_deposits_for_item(
+                pending_item,
+                progress=lambda done, total: bar.progress(done / total, text=f"Deleted {done}/{total} deposits")
+            )
             st.session_state["pending_delete_item"] = None
-        if colD2.button("Cancel", key="cancel_delete_all_deps_btn"):
+            if deleted < matched:
+                st.session_state["delete_all_msg"] = ("warning", f"Deleted {deleted} of {matched} deposits for item: {pending_item} (archive: {archive_id}). Retry to remove the rest.")
+            else:
+                st.session_state["delete_all_msg"] = ("success", f"Deleted {deleted} deposits for item: {pending_item}" + (f" (archive: {archive_id})" if archive_id else ""))
+            st.rerun()
+        if colD2.button("Dry run (count only)", key="dry_run_delete_all_deps_btn"):
+            matched, _, _ = delete_all_deposits_for_item(pending_item, dry_run=True)
+            st.info(f"Dry run: {matched} deposits for [{pending_item}] would be archived and deleted.")
+        if colD3.button("Cancel", key="cancel_delete_all_deps_btn"):
             st.session_state["pending_delete_item"] = None
+            st.rerun(scope="fragment")
+    if ss('delete_all_msg', None):
+        kind, msg = st.session_state.pop('delete_all_msg')
+        getattr(st, kind)(msg)
+
+@page_fragment(admin=True)
+def rebuild_section():
+    st.subheader("Rebuild Item Totals (admin only)")
+    st.caption("Recomputes the per-item and per-user totals shown in the overview from the raw deposits.")
+    # A toggle rather than a button, so the check stays up across the
+    # fragment's reruns (a rebuild shows its effect) until it's switched off.
+    if st.toggle("Check item totals against ledger", key="show_totals_check"):
+        check = item_totals_check()
+        if check is not None:
+            st.dataframe(check, hide_index=True, use_container_width=True)
+            if check["Drift"].any():
+                st.warning("Overview totals differ from the ledger; rebuild item totals to fix them.")
+            else:
+                st.success("Overview totals match the ledger.")
+    if st.button("Rebuild item totals from ledger", key="rebuild_aggregates_btn"):
+        with st.spinner("Recomputing item totals…"):
+            num_deposits = rebuild_item_aggregates()
+        st.session_state["rebuild_msg"] = f"Item totals rebuilt from {num_deposits} deposits."
+        st.rerun()
+    if ss('rebuild_msg', None):
+        st.success(st.session_state.pop('rebuild_msg'))
 
+@page_fragment(admin=True)
+def deposit_browser_section():
+    st.subheader("Deposit Browser (admin only)")
+    st.caption("Pages through the ledger on the server; select rows in the grid to delete them.")
+    if "browse_cursors" not in st.session_state:
+        _reset_pager("browse")
+    colF1, colF2, colF3 = st.columns(3)
+    browse_item = colF1.selectbox("Item", options=["All items"] + ALL_ITEMS, key="browse_item",
+                                  on_change=_reset_pager, args=("browse",))
+    browse_user = colF2.text_input("User", key="browse_user", on_change=_reset_pager, args=("browse",)).strip()
+    browse_dates = colF3.date_input("Date range (UTC)", value=(), key="browse_dates",
+                                    on_change=_reset_pager, args=("browse",))
+    colF4, colF5 = st.columns(2)
+    browse_order = colF4.radio("Sort by time", ["Newest first", "Oldest first"], horizontal=True,
+                               key="browse_order", on_change=_reset_pager, args=("browse",))
+    browse_page_size = colF5.selectbox("Rows per page", BROWSER_PAGE_SIZES, index=1, key="browse_page_size",
+                                       on_change=_reset_pager, args=("browse",))
+
+    browse_cursors = st.session_state["browse_cursors"]
+    page_rows, next_cursor = browse_deposits(
+        None if browse_item == "All items" else browse_item, browse_user, browse_dates,
+        browse_order == "Newest first", browse_page_size, browse_cursors[-1]
+    )
+    page_df = deposits_frame(page_rows)
+    grid = st.dataframe(
+        page_df, hide_index=True, use_container_width=True,
+        column_config={"value": st.column_config.NumberColumn("Value per (Div)", format="%.3f")},
+        on_select="rerun", selection_mode="multi-row",
+        key=f"browse_grid_{st.session_state['browse_generation']}"
+    )
+    selected = [(page_df.at[i, "user"], page_df.at[i, "id"]) for i in grid.selection.rows]
+
+    pager_controls("browse", next_cursor, f"{len(page_df)} deposits shown")
+    if st.button(f"Delete {len(selected)} selected deposits (no undo)", key="browse_delete_btn",
+                 disabled=not selected):
+        num_deleted = delete_deposits(selected)
+        if num_deleted:
+            _reset_pager("browse")
+            st.session_state["browse_msg"] = ("success", f"Deleted {num_deleted} deposits.")
+            st.rerun()
+    if ss('browse_msg', None):
+        kind, msg = st.session_state.pop('browse_msg')
+        getattr(st, kind)(msg)
+
+@page_fragment(admin=True)
+def export_section():
+    st.subheader("Export Ledger and Payouts (admin only)")
+    st.caption("The file is built from storage page by page when you click download. "
+               "Scheduled backups can run `python export.py` instead.")
+    colX1, colX2 = st.columns(2)
+    export_what = colX1.selectbox("Data", list(EXPORT_LABELS), format_func=EXPORT_LABELS.get, key="export_what")
+    export_format = colX2.radio("Format", export.EXPORT_FORMATS, horizontal=True, key="export_format")
+    st.download_button(
+        f"Download {EXPORT_LABELS[export_what]} ({export_format.upper()})",
+        functools.partial(export_file, export_what, export_format),
+        file_name=export.export_filename(export_what, export_format),
+        mime="text/csv" if export_format == "csv" else "application/vnd.apache.parquet",
+        on_click="ignore", key="export_download_btn"
+    )
+
+if ss('admin_logged', False):
+    st.header("🔑 Admin Panel Overview")
+    admin_totals_section()
+    st.markdown("---")
+    add_deposit_section()
+    st.markdown("---")
+    bulk_import_section()
+    st.markdown("---")
+    edit_targets_section()
+    st.markdown("---")
+    delete_all_section()
+    st.markdown("---")
+    rebuild_section()
+    st.markdown("---")
+    deposit_browser_section()
+    st.markdown("---")
+    export_section()
     st.markdown("---")
 
 st.header("Deposits Overview")
-targets, divines, bank_buy_pct = get_item_settings()
-bank_buy_pct = bank_buy_pct or DEFAULT_BANK_BUY_PCT
-all_deposits_df = get_all_deposits()
-
-for cat, items in ORIGINAL_ITEM_CATEGORIES.items():
-    color = CATEGORY_COLORS.get(cat, "#FFD700")
-    st.markdown(f"""
-    <div style='margin-top: 38px;'></div>
-    <h2 style="color:{color}; font-weight:bold; margin-bottom: 14px;">{cat}</h2>
-    """, unsafe_allow_html=True)
-    item_totals = []
-    for item in items:
-        item_df = all_deposits_df[all_deposits_df["item"] == item]
-        total = int(item_df["qty"].sum())
-        item_totals.append((item, total))
-    item_totals.sort(key=lambda x: x[1], reverse=True)
-    for item, total in item_totals:
-        item_color = get_item_color(item)
-        target = targets[item]
-        divine_val = divines[item]
-        divine_total = (total / target * divine_val) if target > 0 else 0
-        instant_sell_price = (divine_val / target) * bank_buy_pct / 100 if target > 0 else 0
-
-        extra_info = ""
-        if divine_val > 0 and target > 0:
-            extra_info = (f"<span style='margin-left:22px; color:#AAA;'>"
-                          f"[Stack = {divine_val:.2f} Divines → Current Value ≈ {divine_total:.2f} Divines | "
-                          f"Instant Sell: <span style='color:#fa0;'>{instant_sell_price:.3f} Divines</span> <span style='font-size:85%; color:#888;'>(per item)</span>]</span>")
-        elif divine_val > 0:
-            extra_info = (f"<span style='margin-left:22px; color:#AAA;'>"
-                          f"[Stack = {divine_val:.2f} Divines → Current Value ≈ {divine_total:.2f} Divines]</span>")
-
-        st.markdown(
-            f"""
-            <div style='
-                display:flex; 
-                align-items:center; 
-                border: 2px solid #222; 
-                border-radius: 10px; 
-                margin: 8px 0 16px 0; 
-                padding: 10px 18px;
-                background: #181818;
-            '>
-                <span style='font-weight:bold; color:{item_color}; font-size:1.18em; letter-spacing:0.5px;'>
-                    [{item}]
-                </span>
-                <span style='margin-left:22px; font-size:1.12em; color:#FFF;'>
-                    <b>Deposited:</b> {total} / {target}
-                </span>
-                {extra_info}
-            </div>
-            """,
-            unsafe_allow_html=True
-        )
 
-        if total >= target:
-            st.success(f"✅ {total}/{target} – Target reached!")
-            st.markdown("""
-            <div style='height:22px; width:100%; background:#22c55e; border-radius:7px; display:flex; align-items:center;'>
-                <span style='margin-left:10px; color:white; font-weight:bold;'>FULL</span>
-            </div>
-            """, unsafe_allow_html=True)
+@page_fragment
+def item_card(item):
+    targets, divines, bank_buy_pct = get_item_settings()
+    bank_buy_pct = bank_buy_pct or DEFAULT_BANK_BUY_PCT
+    total = get_item_aggregates()[item]["total_qty"]
+    item_color = get_item_color(item)
+    target = targets[item]
+    divine_val = divines[item]
+    divine_total = (total / target * divine_val) if target > 0 else 0
+    instant_sell_price = (divine_val / target) * bank_buy_pct / 100 if target > 0 else 0
+
+    extra_info = ""
+    if divine_val > 0 and target > 0:
+        extra_info = (f"<span style='margin-left:22px; color:#AAA;'>"
+                      f"[Stack = {divine_val:.2f} Divines → Current Value ≈ {divine_total:.2f} Divines | "
+                      f"Instant Sell: <span style='color:#fa0;'>{instant_sell_price:.3f} Divines</span> <span style='font-size:85%; color:#888;'>(per item)</span>]</span>")
+    elif divine_val > 0:
+        extra_info = (f"<span style='margin-left:22px; color:#AAA;'>"
+                      f"[Stack = {divine_val:.2f} Divines → Current Value ≈ {divine_total:.2f} Divines]</span>")
+
+    st.markdown(
+        f"""
+        <div style='
+            display:flex; 
+            align-items:center; 
+            border: 2px solid #222; 
+            border-radius: 10px; 
+            margin: 8px 0 16px 0; 
+            padding: 10px 18px;
+            background: #181818;
+        '>
+            <span style='font-weight:bold; color:{item_color}; font-size:1.18em; letter-spacing:0.5px;'>
+                [{item}]
+            </span>
+            <span style='margin-left:22px; font-size:1.12em; color:#FFF;'>
+                <b>Deposited:</b> {total} / {target}
+            </span>
+            {extra_info}
+        </div>
+        """,
+        unsafe_allow_html=True
+    )
+
+    if total >= target:
+        st.success(f"✅ {total}/{target} – Target reached!")
+        st.markdown("""
+        <div style='height:22px; width:100%; background:#22c55e; border-radius:7px; display:flex; align-items:center;'>
+            <span style='margin-left:10px; color:white; font-weight:bold;'>FULL</span>
+        </div>
+        """, unsafe_allow_html=True)
+    else:
+        st.progress(min(total / target, 1.0), text=f"{total}/{target}")
+
+    with st.expander("Per-user breakdown & payout", expanded=False):
+        user_summary = get_payout_tables().get(item)
+        if user_summary is not None:
+            st.dataframe(
+                user_summary.style.format({"Fee (10%)": "{:.1f}", "Payout (Divines, after fee)": "{:.1f}"}),
+                use_container_width=True
+            )
+            if ss('admin_logged', False):
+                st.caption("Individual deposits for this item are in the Deposit Browser in the admin panel.")
         else:
-            st.progress(min(total / target, 1.0), text=f"{total}/{target}")
-
-        with st.expander("Per-user breakdown & payout", expanded=False):
-            item_df = all_deposits_df[all_deposits_df["item"] == item]
-            if not item_df.empty:
-                user_summary = item_df.groupby("user")["qty"].sum().reset_index().rename(columns={"qty": "Quantity"})
-                payouts = []
-                fees = []
-                for idx, row in user_summary.iterrows():
-                    qty = row["Quantity"]
-                    raw_payout = (qty / target) * divine_val if target else 0
-                    fee = math.floor((raw_payout * 0.10) * 10) / 10
-                    payout_after_fee = raw_payout - (raw_payout * 0.10)
-                    payout_final = math.floor(payout_after_fee * 10) / 10
-                    payouts.append(payout_final)
-                    fees.append(fee)
-                user_summary["Fee (10%)"] = fees
-                user_summary["Payout (Divines, after fee)"] = payouts
-                st.dataframe(
-                    user_summary.style.format({"Fee (10%)": "{:.1f}", "Payout (Divines, after fee)": "{:.1f}"}),
-                    use_container_width=True
-                )
-                if ss('admin_logged', False):
-                    st.markdown("---")
-                    st.write("**Individual Deposits (admin-only, with delete option):**")
-                    for idx, row in item_df.sort_values(["user", "timestamp"]).iterrows():
-                        user = row["user"]
-                        qty = row.get("qty", 0)
-                        ts = row.get("timestamp", "")
-                        value = row.get("value", 0)
-                        deposit_id = row.get("id") or None
-                        cols = st.columns([2, 2, 2, 2, 1])
-                        cols[0].write(f"User: `{user}`")
-                        cols[1].write(f"Qty: `{qty}`")
-                        cols[2].write(f"Value: `{value:.2f} Div`")
-                        cols[3].write(f"Time: `{ts}`")
-                        if deposit_id and cols[4].button("Delete", key=f"del_{deposit_id}_{user}_{item}"):
-                            delete_deposit(user, deposit_id)
-            else:
-                st.info("No deposits for this item.")
+            st.info("No deposits for this item.")
+
+@page_fragment
+def overview_section():
+    aggregates = get_item_aggregates()
+    for cat, items in ORIGINAL_ITEM_CATEGORIES.items():
+        color = CATEGORY_COLORS.get(cat, "#FFD700")
+        st.markdown(f"""
+        <div style='margin-top: 38px;'></div>
+        <h2 style="color:{color}; font-weight:bold; margin-bottom: 14px;">{cat}</h2>
+        """, unsafe_allow_html=True)
+        item_totals = []
+        for item in items:
+            item_totals.append((item, aggregates[item]["total_qty"]))
+        item_totals.sort(key=lambda x: x[1], reverse=True)
+        for item, _ in item_totals:
+            item_card(item)
+
+overview_section()
+
+st.markdown("---")
+st.header("📈 Bank Value Over Time")
+
+@page_fragment
+def value_history_section():
+    rollups = get_deposit_rollups()
+    if not rollups:
+        st.info("No deposit history yet."
+                + (" On an existing bank, rebuild item totals to backfill it from the ledger."
+                   if ss('admin_logged', False) else ""))
+        return
+    targets, divines, _ = get_item_settings()
+    history = valuation_history(rollups, get_item_settings_history(), (targets, divines))
+    value_range = st.radio("Range", list(VALUE_HISTORY_RANGES), horizontal=True, key="value_history_range")
+    days = VALUE_HISTORY_RANGES[value_range]
+    st.line_chart(history.iloc[-days:] if days else history, y_label="Divines")
+    st.caption("Value when deposited: what the bank's deposits were worth at the moment they were made. "
+               "Value at that day's prices: the same deposits at the item prices in effect on that day.")
+    st.dataframe(valuation_by_item(rollups, targets, divines), hide_index=True, use_container_width=True,
+                 column_config={col: st.column_config.NumberColumn(col, format="%.3f")
+                                for col in ("Value when deposited", "Value now", "Change")})
+
+value_history_section()
 
 st.markdown("---")
 st.header("💡 What-If Calculator")
 st.write("Estimate your payout value for any combination of items and stack sizes!")
 
-targets, divines, bank_buy_pct = get_item_settings()
-bank_buy_pct = bank_buy_pct or DEFAULT_BANK_BUY_PCT
-calc_inputs = {}
-col1, col2 = st.columns(2)
-for i, item in enumerate(ALL_ITEMS):
-    col = col1 if i % 2 == 0 else col2
-    calc_inputs[item] = col.number_input(f"{item} (calc)", min_value=0, step=1, key=f"calc_{item}")
-
-if st.button("Calculate Payout (What-If)"):
-    st.subheader("Payout Calculation")
-    payout_normal = 0.0
-    payout_instant = 0.0
-    for item, qty in calc_inputs.items():
-        if qty > 0:
-            tgt = targets.get(item, 1)
-            div = divines.get(item, 0.0)
-            per_norm = div / tgt if tgt > 0 else 0
-            per_instant = per_norm * (bank_buy_pct / 100)
-            st.write(
-                f"{item}: {qty} → Stack value: {div:.2f} Div ({tgt} per stack). "
-                f"Deposit value: {per_norm:.3f} Div each, Instant Sell: {per_instant:.3f} Div each"
-            )
-            payout_normal += qty * per_norm
-            payout_instant += qty * per_instant
-    st.success(f"**Normal Deposit Value:** {payout_normal:.3f} Divines\n\n**Instant Sell Value:** {payout_instant:.3f} Divines")
+@page_fragment
+def calculator_section():
+    targets, divines, bank_buy_pct = get_item_settings()
+    bank_buy_pct = bank_buy_pct or DEFAULT_BANK_BUY_PCT
+    calc_inputs = {}
+    col1, col2 = st.columns(2)
+    for i, item in enumerate(ALL_ITEMS):
+        col = col1 if i % 2 == 0 else col2
+        calc_inputs[item] = col.number_input(f"{item} (calc)", min_value=0, step=1, key=f"calc_{item}")
+
+    if st.button("Calculate Payout (What-If)"):
+        st.subheader("Payout Calculation")
+        payout_normal = 0.0
+        payout_instant = 0.0
+        for item, qty in calc_inputs.items():
+            if qty > 0:
+                tgt = targets.get(item, 1)
+                div = divines.get(item, 0.0)
+                per_norm = div / tgt if tgt > 0 else 0
+                per_instant = per_norm * (bank_buy_pct / 100)
+                st.write(
+                    f"{item}: {qty} → Stack value: {div:.2f} Div ({tgt} per stack). "
+                    f"Deposit value: {per_norm:.3f} Div each, Instant Sell: {per_instant:.3f} Div each"
+                )
+                payout_normal += qty * per_norm
+                payout_instant += qty * per_instant
+        st.success(f"**Normal Deposit Value:** {payout_normal:.3f} Divines\n\n**Instant Sell Value:** {payout_instant:.3f} Divines")
+
+calculator_section()
 
 st.markdown("---")
-st.header("Admin Logs (last 30 actions)")
-show_admin_logs(30)
+st.header("Admin Logs")
+
+@page_fragment
+def admin_logs_section():
+    show_admin_logs()
+
+admin_logs_section()
+
+if ss('admin_logged', False):
+    st.markdown("---")
+    show_perf_panel()
+finish_perf_run()
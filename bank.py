@@ -0,0 +1,226 @@
+import csv
+import difflib
+import io
+import re
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+# Bank logic that doesn't need Streamlit: the item catalogue, the ledger and
+# aggregate frames, the payout and valuation math, and bulk import parsing.
+# app.py renders it; bench.py times it.
+
+ORIGINAL_ITEM_CATEGORIES = {
+    "Waystones": [
+        "Waystone EXP + Delirious",
+        "Waystone EXP 35%",
+        "Waystone EXP"
+    ],
+    "White Item Bases": [
+        "Stellar Amulet",
+        "Breach ring level 82",
+        "Heavy Belt"
+    ],
+    "Tablets": [
+        "Tablet Exp 9%+10% (random)",
+        "Grand Project Tablet"
+    ],
+    "Various": [
+        "Logbook level 79-80"
+    ]
+}
+ALL_ITEMS = sum(ORIGINAL_ITEM_CATEGORIES.values(), [])
+DEFAULT_BANK_BUY_PCT = 80
+
+
+def default_item_settings():
+    return ({item: 100 for item in ALL_ITEMS}, {item: 0.0 for item in ALL_ITEMS}, DEFAULT_BANK_BUY_PCT)
+
+
+def item_settings_from_data(data):
+    # (targets, divines, bank_buy_pct) from a stored item settings document.
+    targets, divines, bank_buy_pct = default_item_settings()
+    if data:
+        targets.update(data.get("targets", {}))
+        divines.update(data.get("divines", {}))
+        bank_buy_pct = data.get("bank_buy_pct", DEFAULT_BANK_BUY_PCT)
+    return targets, divines, bank_buy_pct
+
+# --- DEPOSITS FRAME ---
+DEPOSIT_COLUMNS = ["user", "item", "qty", "timestamp", "value", "id"]
+
+
+def deposits_frame(rows):
+    # A page of deposits for display; nothing holds the whole ledger as a frame.
+    df = pd.DataFrame(rows)
+    for col in DEPOSIT_COLUMNS:
+        if col not in df.columns:
+            df[col] = None
+    return pd.DataFrame({
+        "user": df["user"].astype("category"),
+        "item": df["item"].astype("category"),
+        "qty": pd.to_numeric(df["qty"], errors="coerce").fillna(0).astype("int32"),
+        "timestamp": pd.to_datetime(df["timestamp"], errors="coerce", utc=True),
+        "value": pd.to_numeric(df["value"], errors="coerce").astype("float32"),
+        "id": df["id"].astype("str"),
+    })
+
+
+# --- PAYOUTS ---
+FEE_RATE = 0.10
+PAYOUT_COLUMNS = ["user", "Quantity", "Fee (10%)", "Payout (Divines, after fee)"]
+
+
+def aggregates_frame(aggregates):
+    # Long (item, user, qty) frame from the per-item users maps.
+    rows = [(item, user, qty) for item, agg in aggregates.items() for user, qty in agg["users"].items()]
+    return pd.DataFrame(rows, columns=["item", "user", "qty"])
+
+
+def payout_table(user_item_qty, targets, divines):
+    # One groupby(["item", "user"]) pass over an (item, user, qty) frame --
+    # raw deposits or aggregates_frame() -- with fee and payout computed for
+    # every item at once. Rounding matches the original per-row code exactly:
+    # raw = qty / target * stack value, fee and payout floored to 0.1 Div.
+    user_item_qty = user_item_qty[user_item_qty["item"].isin(targets.keys())]
+    table = (
+        user_item_qty.groupby(["item", "user"], sort=True, observed=True)["qty"].sum()
+        .reset_index().rename(columns={"qty": "Quantity"})
+    )
+    table = table[table["Quantity"] > 0].reset_index(drop=True)
+    target = table["item"].map(targets).astype(float)
+    divine_val = table["item"].map(divines).astype(float)
+    raw_payout = np.where(target > 0, (table["Quantity"] / target) * divine_val, 0.0)
+    table["Fee (10%)"] = np.floor((raw_payout * FEE_RATE) * 10) / 10
+    table["Payout (Divines, after fee)"] = np.floor((raw_payout - (raw_payout * FEE_RATE)) * 10) / 10
+    return table
+
+
+def payout_tables_by_item(table):
+    # {item: per-user payout frame} so rendering an item is a dict lookup.
+    return {
+        item: group[PAYOUT_COLUMNS].reset_index(drop=True)
+        for item, group in table.groupby("item", sort=False, observed=True)
+    }
+
+
+# --- VALUATION ---
+VALUE_HISTORY_COLUMNS = ["Value when deposited", "Value at that day's prices"]
+VALUE_BY_ITEM_COLUMNS = ["Item", "Quantity", "Value when deposited", "Value now", "Change"]
+
+
+def unit_prices(targets, divines):
+    # Divines per single item: a full stack (target) is worth divines[item].
+    return {item: (divines.get(item, 0.0) / target if target else 0.0) for item, target in targets.items()}
+
+
+def _prices_by_day(days, settings_history, current_settings):
+    # Unit prices in effect on each day: the last version saved before the
+    # day ended, or the earliest known version for days before any was saved.
+    versions = [(pd.Timestamp(v["timestamp"]), unit_prices(*item_settings_from_data(v)[:2]))
+                for v in settings_history if v.get("timestamp") is not None]
+    if not versions:
+        return pd.DataFrame([unit_prices(*current_settings)] * len(days), index=days)
+    saved_at = pd.DatetimeIndex([ts for ts, _ in versions])
+    last = np.maximum(saved_at.searchsorted(days + pd.Timedelta(days=1)) - 1, 0)
+    return pd.DataFrame([versions[i][1] for i in last], index=days)
+
+
+def valuation_history(rollups, settings_history, current_settings, until=None):
+    # Daily bank value from deposit_rollups() rows, for every day from the
+    # first deposit to until (default: today, UTC): what the deposits held
+    # that day were worth when made, and what they were worth at that day's
+    # prices. current_settings is (targets, divines), used when no settings
+    # version has been saved yet.
+    if not rollups:
+        return pd.DataFrame(columns=VALUE_HISTORY_COLUMNS, dtype=float)
+    df = pd.DataFrame(rollups)
+    df["day"] = pd.to_datetime(df["day"], utc=True)
+    end = pd.Timestamp(until or datetime.now(timezone.utc)).normalize()
+    days = pd.date_range(df["day"].min(), max(df["day"].max(), end), freq="D")
+    held = df.pivot_table(index="day", columns="item", values="qty", aggfunc="sum", fill_value=0)
+    held = held.reindex(days, fill_value=0).cumsum()
+    deposited = df.groupby("day")["value"].sum().reindex(days, fill_value=0.0).cumsum()
+    prices = _prices_by_day(days, settings_history, current_settings).reindex(columns=held.columns, fill_value=0.0)
+    return pd.DataFrame({
+        VALUE_HISTORY_COLUMNS[0]: deposited.round(3),
+        VALUE_HISTORY_COLUMNS[1]: (held * prices.fillna(0.0)).sum(axis=1).round(3),
+    }, index=days)
+
+
+def valuation_by_item(rollups, targets, divines):
+    # Per item: quantity held, what it was worth when deposited and what it
+    # is worth at the current prices.
+    if not rollups:
+        return pd.DataFrame(columns=VALUE_BY_ITEM_COLUMNS)
+    totals = pd.DataFrame(rollups).groupby("item", sort=True)[["qty", "value"]].sum()
+    totals = totals[totals["qty"] != 0]
+    prices = unit_prices(targets, divines)
+    now = totals["qty"] * totals.index.map(lambda item: prices.get(item, 0.0))
+    return pd.DataFrame({
+        "Item": totals.index,
+        "Quantity": totals["qty"].values,
+        "Value when deposited": totals["value"].round(3).values,
+        "Value now": now.round(3).values,
+        "Change": (now - totals["value"]).round(3).values,
+    })
+
+
+# --- BULK IMPORT ---
+IMPORT_COLUMNS = ["user", "item", "qty"]
+# How close (difflib ratio) a typed item name must be to a known item.
+ITEM_MATCH_CUTOFF = 0.6
+
+
+def _normalize_name(name):
+    return re.sub(r"\s+", " ", str(name)).strip().lower()
+
+
+_ITEMS_BY_NAME = {_normalize_name(item): item for item in ALL_ITEMS}
+
+
+def match_item(name):
+    # ALL_ITEMS entry for a typed item name: exact ignoring case and spacing,
+    # else the only item starting with it ("logbook"), else the closest name
+    # above ITEM_MATCH_CUTOFF, else None. A prefix of several items
+    # ("waystone") is None: guessing one would price the row as another item.
+    norm = _normalize_name(name)
+    if norm in _ITEMS_BY_NAME:
+        return _ITEMS_BY_NAME[norm]
+    prefixed = [item for key, item in _ITEMS_BY_NAME.items() if norm and key.startswith(norm)]
+    if prefixed:
+        return prefixed[0] if len(prefixed) == 1 else None
+    close = difflib.get_close_matches(norm, list(_ITEMS_BY_NAME), n=1, cutoff=ITEM_MATCH_CUTOFF)
+    return _ITEMS_BY_NAME[close[0]] if close else None
+
+
+def parse_deposit_rows(text):
+    # user,item,qty rows from a CSV file or pasted text: comma, semicolon or
+    # tab separated, with an optional header row. Returns (rows, errors):
+    # rows are {"line", "user", "item", "typed_item", "qty"}, errors are
+    # (line, message) for the rows that were skipped.
+    lines = text.splitlines()
+    sample = "\n".join(lines[:20])
+    delimiter = "\t" if "\t" in sample else (";" if sample.count(";") > sample.count(",") else ",")
+    rows, errors = [], []
+    for line_no, fields in enumerate(csv.reader(io.StringIO(text), delimiter=delimiter), start=1):
+        fields = [f.strip() for f in fields]
+        if not any(fields):
+            continue
+        if line_no == 1 and [_normalize_name(f) for f in fields[:3]] == IMPORT_COLUMNS:
+            continue
+        if len(fields) != 3:
+            errors.append((line_no, f"expected user, item, qty; got {len(fields)} fields"))
+            continue
+        user, typed_item, qty = fields
+        item = match_item(typed_item)
+        if not user:
+            errors.append((line_no, "missing user"))
+        elif item is None:
+            errors.append((line_no, f"unknown or ambiguous item {typed_item!r}"))
+        elif not qty.isdigit() or int(qty) == 0:
+            errors.append((line_no, f"quantity must be a positive whole number, got {qty!r}"))
+        else:
+            rows.append({"line": line_no, "user": user, "item": item, "typed_item": typed_item, "qty": int(qty)})
+    return rows, errors
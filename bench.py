@@ -0,0 +1,198 @@
+"""Benchmarks for the bank's hot paths against a local SQLite backend.
+
+    python bench.py                              # default size grid
+    python bench.py --sizes 10:1000 1000:100000  # users:deposits pairs
+    python bench.py --output bench_results.json --repeat 5
+
+Each size gets a freshly generated synthetic bank spread over
+ORIGINAL_ITEM_CATEGORIES. Results are written as JSON (one record per
+benchmark and size) so runs from different versions can be diffed.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+import storage
+from bank import ALL_ITEMS, DEFAULT_BANK_BUY_PCT, aggregates_frame, deposits_frame, payout_table, payout_tables_by_item
+
+DEFAULT_SIZES = ["10:1000", "100:10000", "1000:100000"]
+ADMINS = ["Diablo", "JESUS", "LT"]
+
+
+def _log_entry(admin_user, action, details=""):
+    return {"timestamp": datetime.utcnow(), "admin_user": admin_user, "action": action, "details": details}
+
+
+def synthetic_settings(rng):
+    targets = {item: rng.choice([10, 20, 50, 100]) for item in ALL_ITEMS}
+    divines = {item: round(rng.uniform(0.5, 20.0), 2) for item in ALL_ITEMS}
+    return targets, divines, DEFAULT_BANK_BUY_PCT
+
+
+def generate_bank(backend, num_users, num_deposits, seed=0, spread_days=30):
+    # Fills backend through the normal submission path: each submission is
+    # one user depositing up to len(ALL_ITEMS) distinct items. Deposits are
+    # then backdated over spread_days, as in a real league, so daily rollups,
+    # value history and date-range pages aren't measured against a ledger
+    # written in the last second.
+    rng = random.Random(seed)
+    targets, divines, bank_buy_pct = synthetic_settings(rng)
+    backend.save_item_settings(targets, divines, bank_buy_pct)
+    users = [f"user{i:05d}" for i in range(num_users)]
+    remaining = num_deposits
+    while remaining > 0:
+        items = rng.sample(ALL_ITEMS, min(remaining, rng.randint(1, len(ALL_ITEMS))))
+        item_values = {item: (rng.randint(1, 20), divines[item] / targets[item]) for item in items}
+        admin_user = rng.choice(ADMINS)
+        backend.submit_deposits(rng.choice(users), admin_user, item_values, False, uuid.uuid4().hex,
+                                _log_entry(admin_user, "Deposit Added", "synthetic"))
+        remaining -= len(items)
+    with backend._lock, backend._conn:
+        backend._conn.execute(
+            "UPDATE deposits SET timestamp = timestamp - ABS(RANDOM() % ?)", (spread_days * 86400,)
+        )
+    # The daily rollups were written for today; move them with the deposits.
+    backend.rebuild_item_aggregates(ALL_ITEMS)
+    return targets, divines, bank_buy_pct
+
+
+def _time(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return {
+        "repeat": repeat,
+        "min_s": min(timings),
+        "median_s": statistics.median(timings),
+        "max_s": max(timings),
+    }
+
+
+def run_size(num_users, num_deposits, repeat, seed):
+    backend = storage.SQLiteBackend(":memory:")
+    start = time.perf_counter()
+    targets, divines, _ = generate_bank(backend, num_users, num_deposits, seed)
+    results = {"generate_bank": {"repeat": 1, "min_s": time.perf_counter() - start}}
+    rng = random.Random(seed + 1)
+
+    # The deposit browser's first page, the app's only read of raw deposits.
+    results["deposit_browser_page"] = _time(lambda: deposits_frame(backend.page_deposits(page_size=50)[0]), repeat)
+
+    results["overview_aggregation"] = _time(backend.item_aggregates, repeat)
+
+    aggregates = backend.item_aggregates()
+
+    def payouts():
+        payout_tables_by_item(payout_table(aggregates_frame(aggregates), targets, divines))
+    results["payout_computation"] = _time(payouts, repeat)
+
+    def submission():
+        items = rng.sample(ALL_ITEMS, len(ALL_ITEMS))
+        backend.submit_deposits(f"user{rng.randrange(num_users):05d}", "Diablo",
+                                {item: (rng.randint(1, 20), divines[item] / targets[item]) for item in items},
+                                False, uuid.uuid4().hex, _log_entry("Diablo", "Deposit Added", "bench"))
+    results["deposit_submission"] = _time(submission, repeat)
+
+    results["concurrent_admin_totals"] = concurrent_totals(rng.choice(ALL_ITEMS))
+
+    # Destructive, so last: the most deposited item.
+    item = max(aggregates, key=lambda i: aggregates[i]["total_qty"])
+    start = time.perf_counter()
+    matched, deleted, _ = backend.delete_item_deposits(item, "Diablo")
+    results["bulk_delete"] = {"repeat": 1, "min_s": time.perf_counter() - start, "deleted": deleted}
+
+    return [dict(benchmark=name, users=num_users, deposits=num_deposits, **r) for name, r in results.items()]
+
+
+def concurrent_totals(item, num_threads=16, per_thread=50):
+    # Many threads incrementing admin totals and submitting deposits at once
+    # must add up exactly. Each thread opens its own SQLiteBackend on one
+    # database file, as separate app processes would, so nothing but SQLite's
+    # own locking serializes them (one backend shares a lock between threads).
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bank.sqlite3")
+        storage.SQLiteBackend(path)
+        errors = []
+
+        def worker():
+            backend = storage.SQLiteBackend(path)
+            try:
+                for _ in range(per_thread):
+                    backend.increment_admin_totals("JESUS", normal_add=1.0, instant_add=0.5)
+                    backend.submit_deposits("user00000", "LT", {item: (1, 0.25)}, False, uuid.uuid4().hex,
+                                            _log_entry("LT", "Deposit Added", "bench"))
+            except Exception as e:
+                errors.append(repr(e))
+        threads = [threading.Thread(target=worker) for _ in range(num_threads)]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+
+        backend = storage.SQLiteBackend(path)
+        expected = num_threads * per_thread
+        totals = {
+            "JESUS": backend.get_admin_totals("JESUS"),
+            "LT": backend.get_admin_totals("LT"),
+            item: backend.item_aggregates().get(item, {}).get("total_qty", 0),
+        }
+        exact = totals == {"JESUS": (float(expected), expected * 0.5), "LT": (expected * 0.25, 0.0), item: expected}
+        return {"repeat": 1, "min_s": elapsed, "threads": num_threads, "per_thread": per_thread,
+                "totals": totals, "errors": errors[:5], "exact": exact and not errors}
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except Exception:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", default=DEFAULT_SIZES, metavar="USERS:DEPOSITS")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args(argv)
+
+    records = []
+    for size in args.sizes:
+        num_users, num_deposits = (int(x) for x in size.split(":"))
+        for record in run_size(num_users, num_deposits, args.repeat, args.seed):
+            print(f"{record['benchmark']:<30} users={num_users:<6} deposits={num_deposits:<8} "
+                  f"min={record['min_s'] * 1000:10.2f} ms")
+            if record.get("exact") is False:
+                print(f"{'':<30} NOT EXACT: totals={record['totals']} errors={record['errors']}")
+            records.append(record)
+
+    report = {
+        "revision": _git_revision(),
+        "python": platform.python_version(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "results": records,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {len(records)} results to {args.output}")
+    if any(record.get("exact") is False for record in records):
+        sys.exit("Concurrent totals did not add up exactly.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""Streaming exports of the ledger, instant sells, payouts and settlements.
+
+    python export.py --sqlite bank.sqlite3 --output-dir backups/2026-10-17
+    python export.py --service-account firebase.json --format parquet deposits payouts
+    python export.py --sqlite bank.sqlite3 --output-dir - deposits   # CSV to stdout
+
+Deposits and instant sells are read a page at a time and each page is
+written out before the next is fetched, so memory stays flat however long
+the ledger gets. Payouts and settlements are computed from the item
+aggregates (one row per user and item), not from the raw ledger.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+from datetime import datetime, timezone
+
+import storage
+from bank import aggregates_frame, item_settings_from_data, payout_table
+
+EXPORT_PAGE_SIZE = 1000
+EXPORT_FORMATS = ["csv", "parquet"]
+
+# Column order per export; the app's download buttons and the CLI share these.
+EXPORT_COLUMNS = {
+    "deposits": ["user", "item", "qty", "value", "timestamp", "id"],
+    "instant_sells": ["admin_user", "item", "qty", "value", "timestamp", "id"],
+    "payouts": ["item", "user", "qty", "fee", "payout"],
+    "settlements": ["user", "items", "qty", "fee", "payout"],
+}
+# Parquet column types; anything not listed is a string.
+_ARROW_TYPES = {"qty": "int64", "items": "int64", "value": "float64", "fee": "float64", "payout": "float64",
+                "timestamp": "timestamp"}
+
+
+def _pages(fetch, page_size):
+    cursor = None
+    while True:
+        rows, cursor = fetch(newest_first=False, page_size=page_size, cursor=cursor)
+        if rows:
+            yield rows
+        if cursor is None:
+            return
+
+
+def deposit_chunks(backend, page_size=EXPORT_PAGE_SIZE):
+    return _pages(backend.page_deposits, page_size)
+
+
+def instant_sell_chunks(backend, page_size=EXPORT_PAGE_SIZE):
+    return _pages(backend.page_instant_sells, page_size)
+
+
+def _payouts(backend):
+    targets, divines, _ = item_settings_from_data(backend.load_item_settings())
+    return payout_table(aggregates_frame(backend.item_aggregates()), targets, divines).rename(columns={
+        "Quantity": "qty", "Fee (10%)": "fee", "Payout (Divines, after fee)": "payout",
+    })
+
+
+def payout_chunks(backend, page_size=EXPORT_PAGE_SIZE):
+    table = _payouts(backend)
+    for start in range(0, len(table), page_size):
+        yield table.iloc[start:start + page_size].to_dict("records")
+
+
+def settlement_chunks(backend, page_size=EXPORT_PAGE_SIZE):
+    # What each user is owed across all items.
+    table = _payouts(backend).groupby("user", sort=True, observed=True).agg(
+        items=("item", "nunique"), qty=("qty", "sum"), fee=("fee", "sum"), payout=("payout", "sum"),
+    ).reset_index()
+    table["fee"] = table["fee"].round(1)
+    table["payout"] = table["payout"].round(1)
+    for start in range(0, len(table), page_size):
+        yield table.iloc[start:start + page_size].to_dict("records")
+
+
+EXPORTS = {
+    "deposits": deposit_chunks,
+    "instant_sells": instant_sell_chunks,
+    "payouts": payout_chunks,
+    "settlements": settlement_chunks,
+}
+
+
+def _csv_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def write_csv(chunks, columns, out):
+    # out is a text file opened with newline="". Returns the rows written.
+    writer = csv.writer(out)
+    writer.writerow(columns)
+    written = 0
+    for chunk in chunks:
+        writer.writerows([_csv_value(row.get(col)) for col in columns] for row in chunk)
+        written += len(chunk)
+    return written
+
+
+def _arrow_schema(columns):
+    import pyarrow as pa
+    types = {"int64": pa.int64(), "float64": pa.float64(), "timestamp": pa.timestamp("us", tz="UTC")}
+    return pa.schema([(col, types.get(_ARROW_TYPES.get(col), pa.string())) for col in columns])
+
+
+def write_parquet(chunks, columns, out):
+    # out is a path or binary file; each chunk becomes one row group.
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema = _arrow_schema(columns)
+    written = 0
+    with pq.ParquetWriter(out, schema) as writer:
+        for chunk in chunks:
+            writer.write_table(pa.Table.from_pylist([{col: row.get(col) for col in columns} for row in chunk],
+                                                    schema=schema))
+            written += len(chunk)
+    return written
+
+
+def export(backend, what, fmt, out, page_size=EXPORT_PAGE_SIZE):
+    chunks = EXPORTS[what](backend, page_size)
+    columns = EXPORT_COLUMNS[what]
+    if fmt == "csv":
+        return write_csv(chunks, columns, out)
+    return write_parquet(chunks, columns, out)
+
+
+def export_filename(what, fmt, when=None):
+    return f"bank_{what}_{(when or datetime.now(timezone.utc)).strftime('%Y%m%d_%H%M%S')}.{fmt}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("what", nargs="*", metavar="EXPORT",
+                        help=f"any of {', '.join(EXPORTS)} (default: all)")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--sqlite", metavar="PATH", help="SQLite database (default: $BANK_SQLITE_PATH "
+                                                         "when $BANK_STORAGE is sqlite)")
+    source.add_argument("--service-account", metavar="JSON", help="Firebase service account key file")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="csv")
+    parser.add_argument("--output-dir", default=".", help="directory for the files, or - for CSV on stdout")
+    parser.add_argument("--page-size", type=int, default=EXPORT_PAGE_SIZE)
+    args = parser.parse_args(argv)
+    args.what = args.what or list(EXPORTS)
+    unknown = [what for what in args.what if what not in EXPORTS]
+    if unknown:
+        parser.error(f"unknown export {', '.join(unknown)}; choose from {', '.join(EXPORTS)}")
+
+    if args.service_account:
+        with open(args.service_account) as f:
+            backend = storage.FirestoreBackend.from_service_account(json.load(f))
+    elif args.sqlite or os.environ.get("BANK_STORAGE") == "sqlite":
+        backend = storage.SQLiteBackend(args.sqlite or os.environ.get("BANK_SQLITE_PATH", "bank.sqlite3"))
+    else:
+        parser.error("give --sqlite PATH or --service-account JSON")
+
+    if args.output_dir == "-":
+        if args.format != "csv" or len(args.what) != 1:
+            parser.error("--output-dir - writes exactly one CSV export")
+        export(backend, args.what[0], "csv", sys.stdout, args.page_size)
+        return
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    when = datetime.now(timezone.utc)
+    for what in args.what:
+        path = os.path.join(args.output_dir, export_filename(what, args.format, when))
+        if args.format == "csv":
+            with open(path, "w", newline="") as f:
+                written = export(backend, what, "csv", f, args.page_size)
+        else:
+            written = export(backend, what, "parquet", path, args.page_size)
+        print(f"{what:<14} {written:>10} rows -> {path}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+"""Load test: many concurrent sessions driving app.py against a local SQLite bank.
+
+    python loadtest.py                                  # 40 viewers, 8 admins, 2 deleters
+    python loadtest.py --viewers 100 --admins 10 --reruns 10 --think 0.5
+    python loadtest.py --users 500 --deposits 50000 --output loadtest_results.json
+
+Every simulated session is a streamlit.testing AppTest running the real app
+script in this one process, as the sessions of one Streamlit server would:
+caches, the backend connection and background threads are all shared.
+Viewers reload and change the value chart range, admins submit deposits
+through the add-deposit form, deleters delete every deposit of an item.
+Each rerun's metrics.RunReport is captured off the "bank.metrics" logger.
+Results are written as JSON, like bench.py's.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import storage
+from bank import ALL_ITEMS
+from bench import _git_revision, generate_bank
+
+ROLES = ["viewer", "admin", "deleter"]
+MEMORY_SAMPLE_INTERVAL = 0.5
+
+
+def _rss_mb():
+    # Current resident set size; peak RSS where /proc isn't available.
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+
+
+def _percentiles(values):
+    if not values:
+        return {}
+    values = sorted(values)
+
+    def pick(p):
+        return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+    return {"n": len(values), "p50": pick(50), "p90": pick(90), "p95": pick(95), "p99": pick(99), "max": values[-1]}
+
+
+class _RunCollector(logging.Handler):
+    # Every finished run report, as logged by metrics.finish_run().
+
+    def __init__(self):
+        super().__init__(logging.INFO)
+        self.runs = []
+        self._lock = threading.Lock()
+
+    def emit(self, record):
+        report = json.loads(record.getMessage())
+        with self._lock:
+            self.runs.append(report)
+
+
+class _MemorySampler(threading.Thread):
+    def __init__(self):
+        super().__init__(name="loadtest-memory", daemon=True)
+        self.samples = []
+        self._done = threading.Event()
+
+    def run(self):
+        start = time.perf_counter()
+        while not self._done.is_set():
+            self.samples.append((round(time.perf_counter() - start, 2), round(_rss_mb(), 1)))
+            self._done.wait(MEMORY_SAMPLE_INTERVAL)
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+@contextmanager
+def _one_server():
+    # AppTest is written for one session at a time: every run installs its own
+    # mock Runtime and appTest config override and removes them when it ends,
+    # which pulls them out from under sessions still running, and compiles the
+    # script afresh (concurrent compiles trip a CPython AST race). Hold on to
+    # the first runtime, the override and one script cache for the whole load
+    # test instead, as one Streamlit server would.
+    from streamlit.runtime import Runtime
+    from streamlit.testing.v1 import local_script_runner
+    from streamlit.testing.v1.util import patch_config_options
+    script_cache = local_script_runner.ScriptCache
+    shared_cache = script_cache()
+    instance, exists = Runtime.__dict__["instance"], Runtime.__dict__["exists"]
+    pinned = []
+
+    def pinned_instance(cls):
+        if not pinned and cls._instance is not None:
+            pinned.append(cls._instance)
+        return pinned[0] if pinned else instance.__func__(cls)
+
+    Runtime.instance = classmethod(pinned_instance)
+    Runtime.exists = classmethod(lambda cls: bool(pinned) or cls._instance is not None)
+    local_script_runner.ScriptCache = lambda: shared_cache
+    try:
+        with patch_config_options({"global.appTest": True}):
+            yield
+    finally:
+        Runtime.instance, Runtime.exists = instance, exists
+        local_script_runner.ScriptCache = script_cache
+
+
+class SimulatedSession:
+    def __init__(self, app_test_cls, role, name, rng, reruns, think, timeout):
+        self.at = app_test_cls.from_file(os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py"),
+                                         default_timeout=timeout)
+        self.role = role
+        self.name = name
+        self.rng = rng
+        self.reruns = reruns
+        self.think = think
+        self.latencies = []
+        self.exceptions = []
+        self.errors = 0
+        self.session_key = None
+        if role != "viewer":
+            self.at.session_state["admin_logged"] = True
+            self.at.session_state["admin_user"] = rng.choice(["Diablo", "JESUS", "LT"])
+
+    def _timed(self, action):
+        start = time.perf_counter()
+        try:
+            action()
+        except Exception as e:
+            self.exceptions.append(f"{e!r} after {len(self.latencies)} runs; page: "
+                                   f"{[c.value for c in self.at.caption][:1]} {[s.value for s in self.at.subheader][:3]}")
+        self.latencies.append(time.perf_counter() - start)
+        self.exceptions.extend(str(e.value) for e in self.at.exception)
+        # The delete confirmation prompt is an st.error too.
+        self.errors += sum(not e.value.startswith("Confirm:") for e in self.at.error)
+
+    def _step(self, n):
+        at = self.at
+        if self.role == "viewer":
+            if n % 2:
+                at.radio(key="value_history_range").set_value(self.rng.choice(["30 days", "90 days", "All"])).run()
+            else:
+                at.run()
+        elif self.role == "admin":
+            at.text_input(key="deposit_user").set_value(f"user{self.rng.randrange(1000):05d}")
+            for item in self.rng.sample(ALL_ITEMS, self.rng.randint(1, 3)):
+                at.number_input(key=f"add_{item}").set_value(self.rng.randint(1, 20))
+            at.button(key="add_deposit_btn").click().run()
+        elif n % 2:
+            at.button(key="confirm_delete_all_deps_btn").click().run()
+        else:
+            at.selectbox(key="delete_item_select").set_value(self.rng.choice(ALL_ITEMS))
+            at.button(key="delete_all_deps_btn").click().run()
+
+    def run(self, start_delay):
+        time.sleep(start_delay)
+        self._timed(self.at.run)
+        self.session_key = self.at.session_state["perf_session"] if "perf_session" in self.at.session_state else None
+        for n in range(self.reruns):
+            if self.think:
+                time.sleep(self.rng.uniform(0, self.think))
+            if self.exceptions:
+                break
+            self._timed(lambda: self._step(n))
+
+
+def run_load(viewers, admins, deleters, reruns, think, ramp, timeout, seed):
+    # Imported here so BANK_* are set before the app first reads them.
+    from streamlit.testing.v1 import AppTest
+    import metrics
+
+    collector = _RunCollector()
+    metrics.logger.addHandler(collector)
+    metrics.logger.setLevel(logging.INFO)
+
+    rng = random.Random(seed)
+    sessions = [SimulatedSession(AppTest, role, f"{role}{i}", random.Random(rng.random()), reruns, think, timeout)
+                for role, count in zip(ROLES, (viewers, admins, deleters)) for i in range(count)]
+    rng.shuffle(sessions)
+
+    sampler = _MemorySampler()
+    rss_start = _rss_mb()
+    sampler.start()
+    start = time.perf_counter()
+    threads = [threading.Thread(target=s.run, args=(rng.uniform(0, ramp),), name=f"loadtest-{s.name}")
+               for s in sessions]
+    with _one_server():
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    wall = time.perf_counter() - start
+    sampler.stop()
+    metrics.logger.removeHandler(collector)
+
+    by_session = {}
+    for report in collector.runs:
+        by_session.setdefault(report["session"], []).append(report)
+    results = {}
+    for role in ROLES:
+        role_sessions = [s for s in sessions if s.role == role]
+        if not role_sessions:
+            continue
+        reports = [by_session.get(s.session_key, []) for s in role_sessions]
+        backend_calls = [sum(r["backend_calls"] for r in rs) for rs in reports]
+        docs = [sum(r["docs"] for r in rs) for rs in reports]
+        results[role] = {
+            "sessions": len(role_sessions),
+            "reruns": sum(len(s.latencies) for s in role_sessions),
+            "latency_ms": {k: round(v * 1000, 1) if k != "n" else v
+                           for k, v in _percentiles([l for s in role_sessions for l in s.latencies]).items()},
+            "server_wall_ms": _percentiles([r["wall_ms"] for rs in reports for r in rs]),
+            "backend_calls_per_session": {"mean": round(sum(backend_calls) / len(backend_calls), 1),
+                                          "max": max(backend_calls)},
+            "docs_per_session": {"mean": round(sum(docs) / len(docs), 1), "max": max(docs)},
+            "exceptions": sum(len(s.exceptions) for s in role_sessions),
+            "error_messages": sum(s.errors for s in role_sessions),
+        }
+    peak = max((mb for _, mb in sampler.samples), default=rss_start)
+    results["memory"] = {
+        "rss_start_mb": round(rss_start, 1),
+        "rss_end_mb": round(_rss_mb(), 1),
+        "rss_peak_mb": peak,
+        "growth_mb": round(_rss_mb() - rss_start, 1),
+        "samples": sampler.samples,
+    }
+    results["throughput"] = {"wall_s": round(wall, 2), "reruns": sum(len(s.latencies) for s in sessions),
+                             "reruns_per_s": round(sum(len(s.latencies) for s in sessions) / wall, 2)}
+    results["first_errors"] = [e for s in sessions for e in s.exceptions][:5]
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--viewers", type=int, default=40)
+    parser.add_argument("--admins", type=int, default=8)
+    parser.add_argument("--deleters", type=int, default=2)
+    parser.add_argument("--reruns", type=int, default=5, help="reruns per session after its first load")
+    parser.add_argument("--think", type=float, default=0.0, help="max random pause between reruns, seconds")
+    parser.add_argument("--ramp", type=float, default=2.0, help="sessions start spread over this many seconds")
+    parser.add_argument("--timeout", type=float, default=120.0, help="per-rerun timeout, seconds")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--deposits", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="loadtest_results.json")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bank.sqlite3")
+        generate_bank(storage.SQLiteBackend(path), args.users, args.deposits, args.seed)
+        os.environ["BANK_STORAGE"] = "sqlite"
+        os.environ["BANK_SQLITE_PATH"] = path
+        results = run_load(args.viewers, args.admins, args.deleters, args.reruns, args.think, args.ramp,
+                           args.timeout, args.seed)
+
+    for role in ROLES:
+        if role in results:
+            r = results[role]
+            lat = r["latency_ms"]
+            print(f"{role:<8} sessions={r['sessions']:<4} reruns={r['reruns']:<5} "
+                  f"p50={lat.get('p50', 0):8.1f} ms p95={lat.get('p95', 0):8.1f} ms p99={lat.get('p99', 0):8.1f} ms "
+                  f"backend calls/session={r['backend_calls_per_session']['mean']:<7} "
+                  f"exceptions={r['exceptions']}")
+    mem, tp = results["memory"], results["throughput"]
+    print(f"memory   start={mem['rss_start_mb']} MB peak={mem['rss_peak_mb']} MB growth={mem['growth_mb']} MB")
+    print(f"overall  {tp['reruns']} reruns in {tp['wall_s']} s ({tp['reruns_per_s']}/s)")
+
+    report = {
+        "revision": _git_revision(),
+        "python": platform.python_version(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "config": vars(args),
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+import functools
+import json
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+# Per-rerun instrumentation. Every StorageBackend call made through
+# InstrumentedBackend, and every app helper wrapped with instrumented(), is
+# timed and counted into the RunReport of the script run that made it (and
+# into the process-wide REGISTRY). Finished reports are logged as one JSON
+# line each on the "bank.metrics" logger and kept for the admin panel;
+# REGISTRY.prometheus_text() exports the running totals. REGISTRY also keeps
+# how long this process took to start: the first run's imports, backend
+# creation and the first full script run.
+
+logger = logging.getLogger("bank.metrics")
+RECENT_RUNS = 50
+
+
+def _one(result):
+    return 1
+
+
+def _none(result):
+    return 0
+
+
+# Documents read or written by a backend call, where its result says so.
+# Anything else counts as one document.
+DOC_COUNTS = {
+    "recent_admin_logs": len,
+    "all_deposits": len,
+    "item_aggregates": len,
+    "deposit_rollups": len,
+    "item_settings_history": len,
+    "page_deposits": lambda result: len(result[0]),
+    "page_instant_sells": lambda result: len(result[0]),
+    "page_admin_logs": lambda result: len(result[0]),
+    "admin_log_rollups": len,
+    "compact_admin_logs": lambda result: result,
+    "import_deposits": sum,
+    "add_admin_logs": lambda result: result,
+    "delete_item_deposits": lambda result: result[0],
+    "rebuild_item_aggregates": lambda result: result,
+    "watch_item_aggregates": _none,
+    "watch_item_settings": _none,
+}
+
+
+def _submitted_docs(result, user, admin_user, item_values, instant_sell, *args, **kwargs):
+    # The submissions marker, one entry per item, the admin totals and the
+    # log; a normal deposit adds the user document, one aggregate per item
+    # and the day's rollup. A duplicate stops at the marker.
+    if result == "duplicate":
+        return 1
+    n = len(item_values)
+    return n + 3 if instant_sell else 2 * n + 5
+
+
+def _deleted_docs(result, keys):
+    # Every key is read; each deposit found is deleted and updates at most
+    # one aggregate and one rollup.
+    return len(keys) + 3 * result
+
+
+# Like DOC_COUNTS, for calls whose count also depends on their arguments:
+# called with the result followed by the call's own arguments.
+CALL_DOC_COUNTS = {
+    "submit_deposits": _submitted_docs,
+    "delete_deposits": _deleted_docs,
+}
+
+
+class CallStats:
+    __slots__ = ("calls", "errors", "seconds", "docs")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.docs = 0
+
+    def add(self, seconds, docs, error):
+        self.calls += 1
+        self.errors += int(error)
+        self.seconds += seconds
+        self.docs += docs
+
+
+class RunReport:
+    # What one Streamlit script run cost. Interrupted runs (st.rerun,
+    # st.stop) aren't finished, so their calls roll into the next report.
+
+    def __init__(self, session=None):
+        self.session = session
+        # "app" for a full script run, else the name of the rerun fragment.
+        self.scope = "app"
+        self.started_at = datetime.now(timezone.utc)
+        self._start = time.perf_counter()
+        self.wall_seconds = None
+        self._lock = threading.Lock()
+        self.calls = {}   # (kind, name) -> CallStats
+        self.cache = {}   # name -> [hits, misses]
+        self.phases = {}  # name -> seconds, e.g. "setup": script start to first section
+
+    def record(self, kind, name, seconds, docs, error):
+        with self._lock:
+            self.calls.setdefault((kind, name), CallStats()).add(seconds, docs, error)
+
+    def record_cache(self, name, hit):
+        with self._lock:
+            self.cache.setdefault(name, [0, 0])[0 if hit else 1] += 1
+
+    def record_phase(self, phase, seconds):
+        with self._lock:
+            self.phases[phase] = seconds
+
+    def elapsed(self):
+        return self.wall_seconds if self.wall_seconds is not None else time.perf_counter() - self._start
+
+    def rows(self):
+        with self._lock:
+            return [
+                {"kind": kind, "name": name, "calls": s.calls, "errors": s.errors,
+                 "ms": round(s.seconds * 1000, 2), "docs": s.docs if kind == "backend" else None}
+                for (kind, name), s in sorted(self.calls.items(), key=lambda kv: -kv[1].seconds)
+            ]
+
+    def summary(self):
+        with self._lock:
+            backend = [s for (kind, _), s in self.calls.items() if kind == "backend"]
+            return {
+                "started_at": self.started_at.isoformat(),
+                "session": self.session,
+                "scope": self.scope,
+                "wall_ms": round(self.elapsed() * 1000, 2),
+                "backend_calls": sum(s.calls for s in backend),
+                "backend_errors": sum(s.errors for s in backend),
+                "backend_ms": round(sum(s.seconds for s in backend) * 1000, 2),
+                "docs": sum(s.docs for s in backend),
+                "cache_hits": sum(hits for hits, _ in self.cache.values()),
+                "cache_misses": sum(misses for _, misses in self.cache.values()),
+                **{f"{phase}_ms": round(seconds * 1000, 2) for phase, seconds in self.phases.items()},
+            }
+
+    def as_dict(self):
+        d = self.summary()
+        d["calls"] = self.rows()
+        with self._lock:
+            d["cache"] = {name: {"hits": h, "misses": m} for name, (h, m) in self.cache.items()}
+        return d
+
+
+class Registry:
+    # Process-wide totals (including calls made outside any script run, e.g.
+    # from listener threads) and the most recent finished run reports.
+
+    def __init__(self, recent=RECENT_RUNS):
+        self._lock = threading.Lock()
+        self.calls = {}
+        self.cache = {}
+        self.runs = 0
+        self.run_seconds = 0.0
+        self.phases = {}   # name -> [seconds, runs]
+        self.startup = {}  # phase -> seconds, first value only
+        self.recent = deque(maxlen=recent)
+
+    def record(self, kind, name, seconds, docs, error):
+        with self._lock:
+            self.calls.setdefault((kind, name), CallStats()).add(seconds, docs, error)
+
+    def record_cache(self, name, hit):
+        with self._lock:
+            self.cache.setdefault(name, [0, 0])[0 if hit else 1] += 1
+
+    def record_startup(self, phase, seconds):
+        # Only the first value counts: later calls are warm reruns.
+        with self._lock:
+            self.startup.setdefault(phase, seconds)
+
+    def startup_phases(self):
+        with self._lock:
+            return dict(self.startup)
+
+    def finish(self, report):
+        with self._lock:
+            self.runs += 1
+            self.run_seconds += report.wall_seconds
+            for phase, seconds in report.phases.items():
+                totals = self.phases.setdefault(phase, [0.0, 0])
+                totals[0] += seconds
+                totals[1] += 1
+            self.recent.append(report)
+
+    def recent_runs(self):
+        with self._lock:
+            return list(self.recent)
+
+    def prometheus_text(self):
+        with self._lock:
+            calls = sorted(self.calls.items())
+            cache = sorted(self.cache.items())
+            runs, run_seconds = self.runs, self.run_seconds
+            phases = sorted((phase, tuple(totals)) for phase, totals in self.phases.items())
+            startup = sorted(self.startup.items())
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{k}="{v}"' for k, v in labels.items())
+                lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+        for prefix, label, kind in (("bank_backend", "method", "backend"), ("bank_helper", "helper", "helper")):
+            stats = [({label: name}, s) for (k, name), s in calls if k == kind]
+            metric(f"{prefix}_calls_total", "counter", f"Calls per {label}.",
+                   [(labels, s.calls) for labels, s in stats])
+            metric(f"{prefix}_errors_total", "counter", f"Calls per {label} that raised.",
+                   [(labels, s.errors) for labels, s in stats])
+            metric(f"{prefix}_seconds_total", "counter", f"Time spent per {label}.",
+                   [(labels, round(s.seconds, 6)) for labels, s in stats])
+        metric("bank_backend_documents_total", "counter", "Documents read or written per storage method.",
+               [({"method": name}, s.docs) for (k, name), s in calls if k == "backend"])
+        metric("bank_cache_lookups_total", "counter", "Cached helper lookups by result.",
+               [({"cache": name, "result": result}, n)
+                for name, (hits, misses) in cache for result, n in (("hit", hits), ("miss", misses))])
+        metric("bank_script_run_seconds", "summary", "Wall time of finished Streamlit script runs.", [])
+        lines.append(f"bank_script_run_seconds_sum {round(run_seconds, 6)}")
+        lines.append(f"bank_script_run_seconds_count {runs}")
+        metric("bank_script_phase_seconds", "summary", "Time to reach each phase of a script run.", [])
+        for phase, (seconds, count) in phases:
+            lines.append(f'bank_script_phase_seconds_sum{{phase="{phase}"}} {round(seconds, 6)}')
+            lines.append(f'bank_script_phase_seconds_count{{phase="{phase}"}} {count}')
+        metric("bank_startup_seconds", "gauge", "Cold-start time of this server process by phase.",
+               [({"phase": phase}, round(seconds, 6)) for phase, seconds in startup])
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+_resolver = None
+_lookups = threading.local()
+
+
+def set_run_resolver(resolver):
+    # resolver() returns the RunReport of the calling thread's script run,
+    # or None outside of one.
+    global _resolver
+    _resolver = resolver
+
+
+def current_run():
+    try:
+        return _resolver() if _resolver else None
+    except Exception:
+        return None
+
+
+def _record(kind, name, seconds, docs, error):
+    REGISTRY.record(kind, name, seconds, docs, error)
+    report = current_run()
+    if report is not None:
+        report.record(kind, name, seconds, docs, error)
+
+
+def _record_cache(name, hit):
+    REGISTRY.record_cache(name, hit)
+    report = current_run()
+    if report is not None:
+        report.record_cache(name, hit)
+
+
+def finish_run(report):
+    report.wall_seconds = time.perf_counter() - report._start
+    REGISTRY.finish(report)
+    logger.info(json.dumps(report.as_dict()))
+
+
+def cache_miss(name):
+    # Called from inside a cached function's body, which only runs on a
+    # miss; marks the innermost open instrumented(name, cached=True) call.
+    for lookup in reversed(getattr(_lookups, "stack", [])):
+        if lookup[0] == name:
+            lookup[1] = True
+            return
+
+
+def instrumented(name, cached=False):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if cached:
+                if not hasattr(_lookups, "stack"):
+                    _lookups.stack = []
+                _lookups.stack.append([name, False])
+            start = time.perf_counter()
+            error = True
+            try:
+                result = fn(*args, **kwargs)
+                error = False
+                return result
+            finally:
+                _record("helper", name, time.perf_counter() - start, 0, error)
+                if cached:
+                    _, missed = _lookups.stack.pop()
+                    _record_cache(name, not missed)
+        return wrapper
+    return decorator
+
+
+class InstrumentedBackend:
+    # Transparent proxy over a StorageBackend: public method calls are timed
+    # and counted, everything else passes straight through.
+
+    def __init__(self, backend):
+        self._backend = backend
+
+    def __getattr__(self, name):
+        attr = getattr(self._backend, name)
+        if name.startswith("_") or not callable(attr):
+            return attr
+        count_docs = DOC_COUNTS.get(name, _one)
+        count_call_docs = CALL_DOC_COUNTS.get(name)
+
+        @functools.wraps(attr)
+        def call(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = attr(*args, **kwargs)
+            except Exception:
+                _record("backend", name, time.perf_counter() - start, 0, True)
+                raise
+            docs = count_call_docs(result, *args, **kwargs) if count_call_docs else count_docs(result)
+            _record("backend", name, time.perf_counter() - start, docs, False)
+            return result
+        return call
@@ -0,0 +1,1402 @@
+import json
+import random
+import sqlite3
+import threading
+import uuid
+from datetime import datetime, timezone
+
+# Firestore is optional, and importing it (grpc and friends) is slow, so
+# it's only imported when a FirestoreBackend is created: the SQLite backend
+# works without firebase-admin and never pays for it.
+firestore = None
+AlreadyExists = InvalidArgument = MethodNotImplemented = BulkRetry = BulkWriterOptions = None
+
+
+def _import_firestore():
+    global firestore, AlreadyExists, InvalidArgument, MethodNotImplemented, BulkRetry, BulkWriterOptions
+    if firestore is None:
+        # Not guarded: a missing or broken firebase-admin must fail loudly
+        # rather than quietly leave the default backend unusable.
+        try:
+            from firebase_admin import firestore as firestore_module
+        except ImportError as e:
+            raise ImportError("The Firestore backend needs firebase-admin (pip install firebase-admin); "
+                              "set BANK_STORAGE=sqlite to run without it") from e
+        from google.api_core.exceptions import AlreadyExists, InvalidArgument, MethodNotImplemented
+        from google.cloud.firestore_v1.bulk_writer import BulkRetry, BulkWriterOptions
+        firestore = firestore_module
+
+
+# Rows handed to the app are plain dicts:
+#   deposits:   {"user", "item", "qty", "value", "timestamp", "id"}
+#   aggregates: {item: {"item", "total_qty", "total_value", "users": {user: qty}}}
+# Timestamps are timezone-aware UTC datetimes.
+
+DELETE_CHUNK_SIZE = 500
+SETTINGS_HISTORY_START = datetime(1970, 1, 1, tzinfo=timezone.utc)
+DELETE_MAX_ATTEMPTS = 5
+# Deposits per bulk import chunk. On Firestore a chunk is one batch: a
+# deposit write and a user document each, plus one aggregate write per item,
+# the admin totals and the chunk's submissions marker (<= 500 writes).
+IMPORT_CHUNK_SIZE = 200
+# Admin logs compacted per transaction; each log is one delete.
+LOG_COMPACT_CHUNK = 400
+# Admin logs per batched write (Firestore allows 500 writes per batch).
+LOG_WRITE_CHUNK = 500
+
+
+def _utc(dt):
+    # Naive datetimes (datetime.utcnow()) are UTC throughout the app.
+    return dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt.astimezone(timezone.utc)
+
+
+def _day(dt):
+    # Rollup key: the UTC calendar day, "YYYY-MM-DD".
+    return _utc(dt).date().isoformat()
+
+
+def _empty_aggregate(item):
+    return {"item": item, "total_qty": 0, "total_value": 0.0, "users": {}}
+
+
+def _add_to_aggregates(aggregates, row):
+    qty = int(row.get("qty") or 0)
+    agg = aggregates.setdefault(row["item"], _empty_aggregate(row["item"]))
+    agg["total_qty"] += qty
+    agg["total_value"] += float(row.get("value") or 0.0) * qty
+    agg["users"][row["user"]] = agg["users"].get(row["user"], 0) + qty
+
+
+class ArchiveFailed(Exception):
+    def __init__(self, message, num_matched):
+        super().__init__(message)
+        self.num_matched = num_matched
+
+
+class StorageBackend:
+    # Everything app.py persists goes through one of these. Writes that the
+    # app treats as one action (a submission, a delete) are atomic in every
+    # backend, and ledger writes keep item aggregates and admin totals in step.
+
+    def warm_up(self):
+        # Called once after the backend is created, so the first page view
+        # doesn't pay for opening connections.
+        pass
+
+    # --- settings ---
+    def load_item_settings(self):
+        # Raw settings dict ({"targets", "divines", "bank_buy_pct"}) or None.
+        raise NotImplementedError
+
+    def save_item_settings(self, targets, divines, bank_buy_pct):
+        # Also records the saved values as a new version in the history. If
+        # the history is still empty, the settings stored before it existed
+        # are recorded first, dated SETTINGS_HISTORY_START, so the days
+        # before this save keep their prices.
+        raise NotImplementedError
+
+    def item_settings_history(self, since=None):
+        # Every saved version of the item settings, oldest first:
+        # [{"timestamp", "targets", "divines", "bank_buy_pct"}].
+        raise NotImplementedError
+
+    # --- admin logs ---
+    # Entries are {"timestamp", "admin_user", "action", "details", "data"}:
+    # details is a short human summary, data a dict of structured fields.
+    def add_admin_log(self, entry):
+        raise NotImplementedError
+
+    def add_admin_logs(self, entries):
+        # entries: [(log_id, entry)] written together. Backends whose commits
+        # can succeed unacknowledged store each entry under its log_id, so a
+        # retried write doesn't duplicate it. Returns how many were written.
+        for _, entry in entries:
+            self.add_admin_log(entry)
+        return len(entries)
+
+    def recent_admin_logs(self, n):
+        raise NotImplementedError
+
+    def page_admin_logs(self, admin_user=None, action=None, since=None, until=None, page_size=30, cursor=None):
+        # Newest first, paged like page_deposits(): returns (rows, next_cursor).
+        raise NotImplementedError
+
+    def compact_admin_logs(self, before):
+        # Folds every log older than before into per-day counts by admin and
+        # action (see admin_log_rollups()) and deletes it. Returns how many
+        # logs were compacted.
+        raise NotImplementedError
+
+    def admin_log_rollups(self, since=None, until=None):
+        # [{"day": "YYYY-MM-DD", "admin_user", "action", "count"}], newest day first.
+        raise NotImplementedError
+
+    # --- admin totals ---
+    def get_admin_totals(self, admin_user):
+        raise NotImplementedError
+
+    def increment_admin_totals(self, admin_user, normal_add=0.0, instant_add=0.0):
+        raise NotImplementedError
+
+    def reset_admin_totals(self, admin_user):
+        # Zeroes the totals and returns the (normal, instant) values before.
+        raise NotImplementedError
+
+    # --- ledger writes ---
+    def submit_deposits(self, user, admin_user, item_values, instant_sell, submission_id, log_entry):
+        # Commits every entry of one submission plus aggregates, admin totals
+        # and log_entry atomically. item_values maps item -> (qty, value_per).
+        # Returns "added", or "duplicate" if submission_id was seen before.
+        raise NotImplementedError
+
+    def import_deposits(self, admin_user, deposits, import_id, progress=None):
+        # Adds deposits [(user, item, qty, value_per)] in chunks of
+        # IMPORT_CHUNK_SIZE. Each chunk commits its ledger entries, aggregates
+        # and admin totals together under submission id "{import_id}-{n}", so
+        # re-running an interrupted import skips the chunks that landed.
+        # Writes no log entry (the caller logs one summary). Returns
+        # (num_added, num_skipped); progress(done, total) runs per chunk.
+        num_added = num_skipped = 0
+        for n, start in enumerate(range(0, len(deposits), IMPORT_CHUNK_SIZE)):
+            chunk = deposits[start:start + IMPORT_CHUNK_SIZE]
+            if self._import_chunk(admin_user, chunk, f"{import_id}-{n}"):
+                num_added += len(chunk)
+            else:
+                num_skipped += len(chunk)
+            if progress:
+                progress(start + len(chunk), len(deposits))
+        return num_added, num_skipped
+
+    def _import_chunk(self, admin_user, chunk, submission_id):
+        # Returns False if submission_id was already committed.
+        raise NotImplementedError
+
+    def delete_deposits(self, keys):
+        # Deletes the (user, deposit_id) keys in one transaction per chunk,
+        # with aggregate and rollup updates; returns how many existed.
+        raise NotImplementedError
+
+    def delete_deposit(self, user, deposit_id):
+        # Returns False if the deposit no longer exists.
+        return self.delete_deposits([(user, deposit_id)]) == 1
+
+    def delete_item_deposits(self, item, admin_user, dry_run=False, progress=None):
+        # Archives then deletes every deposit of item. Returns
+        # (num_matched, num_deleted, archive_id); progress(done, total) is
+        # called after each chunk. Raises ArchiveFailed before deleting
+        # anything if the archive could not be written.
+        raise NotImplementedError
+
+    # --- ledger reads ---
+    def all_deposits(self):
+        raise NotImplementedError
+
+    def page_deposits(self, item=None, user=None, since=None, until=None, newest_first=True,
+                      page_size=50, cursor=None):
+        # One page of deposits ordered by timestamp, optionally filtered by
+        # item, user and a [since, until) time range. Returns
+        # (rows, next_cursor); next_cursor is None on the last page and is
+        # passed back as cursor to fetch the following page.
+        raise NotImplementedError
+
+    def page_instant_sells(self, admin_user=None, newest_first=True, page_size=50, cursor=None):
+        # Same contract as page_deposits, over instant sells, optionally for
+        # one admin. Rows carry admin_user instead of user.
+        raise NotImplementedError
+
+    # --- aggregates ---
+    def item_aggregates(self):
+        raise NotImplementedError
+
+    def rebuild_item_aggregates(self, items):
+        # Recomputes aggregates for items (and any item found in the ledger)
+        # and every deposit rollup from the raw deposits; returns the number
+        # of deposits read.
+        raise NotImplementedError
+
+    def deposit_rollups(self, since=None, until=None):
+        # Per-day, per-item ledger totals, kept in step by every ledger write
+        # like the aggregates: [{"day": "YYYY-MM-DD", "item", "qty", "value"}],
+        # oldest day first. value is what the deposits were worth when made
+        # (qty * value per item); deletes count against the deposit's own day.
+        raise NotImplementedError
+
+    def ledger_item_totals(self, items, user=None):
+        # {item: {"count", "total_qty"}} computed from the ledger itself rather
+        # than item_aggregates, optionally for one user. This fallback reads
+        # every deposit; backends that can aggregate server-side override it.
+        totals = {item: {"count": 0, "total_qty": 0} for item in items}
+        for row in self.all_deposits():
+            if row.get("item") in totals and (user is None or row["user"] == user):
+                totals[row["item"]]["count"] += 1
+                totals[row["item"]]["total_qty"] += int(row.get("qty") or 0)
+        return totals
+
+    # --- change listeners ---
+    # Backends that can push changes return a handle with .is_active and
+    # .unsubscribe(); the others return None and the app polls instead.
+    def watch_item_aggregates(self, on_change):
+        return None
+
+    def watch_item_settings(self, on_change):
+        return None
+
+
+# --- FIRESTORE ---
+
+def _firestore_deposit_row(dep):
+    d = dep.to_dict()
+    # collection_group results live at users/{user}/deposits/{id}
+    d["user"] = dep.reference.parent.parent.id
+    d["id"] = dep.id
+    return d
+
+
+def _firestore_aggregate(doc):
+    d = doc.to_dict()
+    return {
+        "item": doc.id,
+        "total_qty": int(d.get("total_qty", 0)),
+        "total_value": float(d.get("total_value", 0.0)),
+        "users": {u: int(q) for u, q in d.get("users", {}).items() if q > 0}
+    }
+
+
+class FirestoreBackend(StorageBackend):
+    # Layout:
+    #   users/{user}/deposits/{id}           ledger
+    #   instant_sells/{admin}/entries/{id}   admin-only instant sells
+    #   item_aggregates/{item}               total_qty, total_value, users map
+    #   admin_totals/{admin}[/shards/{n}]    running admin totals
+    #   admin_logs/{id}, submissions/{id},
+    #   deposit_archive/{id}/rows/{id}, meta/item_settings
+    #   admin_log_rollups/{YYYY-MM-DD}       count, counts.{admin}.{action}
+    #   deposit_rollups/{YYYY-MM-DD}         items.{item}.qty, items.{item}.value
+    #   item_settings_history/{id}           timestamp + one saved settings version
+    # The collection-group queries need collection-group indexes on
+    # deposits.timestamp and deposits.item (and on entries.timestamp for
+    # instant sell exports). Filtered admin log pages need
+    # composite indexes on admin_logs (admin_user, timestamp),
+    # (action, timestamp) and (admin_user, action, timestamp).
+
+    def __init__(self, client, admin_total_shards=None):
+        _import_firestore()
+        self.db = client
+        # Admins who deposit in bursts can spread their totals over several
+        # shard documents so concurrent increments don't serialize on one
+        # document. Readers sum the base document and its shards.
+        self.admin_total_shards = admin_total_shards or {}
+
+    @classmethod
+    def from_service_account(cls, service_account_info, **kwargs):
+        import firebase_admin
+        from firebase_admin import credentials
+        _import_firestore()
+        if not firebase_admin._apps:
+            firebase_admin.initialize_app(credentials.Certificate(service_account_info))
+        return cls(firestore.client(), **kwargs)
+
+    def warm_up(self):
+        # One small read opens the client's gRPC channel, which every later
+        # call of this process reuses.
+        self.db.collection("meta").document("item_settings").get()
+
+    # --- settings ---
+    def load_item_settings(self):
+        doc = self.db.collection("meta").document("item_settings").get()
+        return doc.to_dict() if doc.exists else None
+
+    def _save_item_settings_txn(self, transaction, data):
+        settings_ref = self.db.collection("meta").document("item_settings")
+        history_ref = self.db.collection("item_settings_history")
+        # Reads before writes.
+        stored = settings_ref.get(transaction=transaction)
+        if stored.exists and not list(transaction.get(history_ref.limit(1))):
+            stored = stored.to_dict()
+            transaction.set(history_ref.document(), {
+                "targets": stored.get("targets"),
+                "divines": stored.get("divines"),
+                "bank_buy_pct": stored.get("bank_buy_pct"),
+                "timestamp": SETTINGS_HISTORY_START
+            })
+        transaction.set(settings_ref, data, merge=True)
+        transaction.set(history_ref.document(), dict(data, timestamp=datetime.utcnow()))
+
+    def save_item_settings(self, targets, divines, bank_buy_pct):
+        data = {
+            "targets": targets,
+            "divines": divines,
+            "bank_buy_pct": bank_buy_pct
+        }
+        firestore.transactional(self._save_item_settings_txn)(self.db.transaction(), data)
+
+    def item_settings_history(self, since=None):
+        query = self.db.collection("item_settings_history")
+        if since:
+            query = query.where(filter=firestore.FieldFilter("timestamp", ">=", since))
+        return [doc.to_dict() for doc in query.order_by("timestamp").stream()]
+
+    # --- admin logs ---
+    def add_admin_log(self, entry):
+        self.db.collection("admin_logs").add(entry)
+
+    def add_admin_logs(self, entries):
+        logs_ref = self.db.collection("admin_logs")
+        for start in range(0, len(entries), LOG_WRITE_CHUNK):
+            batch = self.db.batch()
+            for log_id, entry in entries[start:start + LOG_WRITE_CHUNK]:
+                batch.set(logs_ref.document(log_id), entry)
+            batch.commit()
+        return len(entries)
+
+    def recent_admin_logs(self, n):
+        logs_ref = (
+            self.db.collection("admin_logs")
+            .order_by("timestamp", direction=firestore.Query.DESCENDING)
+            .limit(n)
+            .stream()
+        )
+        return [l.to_dict() for l in logs_ref]
+
+    def page_admin_logs(self, admin_user=None, action=None, since=None, until=None, page_size=30, cursor=None):
+        query = self.db.collection("admin_logs")
+        if admin_user:
+            query = query.where(filter=firestore.FieldFilter("admin_user", "==", admin_user))
+        if action:
+            query = query.where(filter=firestore.FieldFilter("action", "==", action))
+        if since:
+            query = query.where(filter=firestore.FieldFilter("timestamp", ">=", since))
+        if until:
+            query = query.where(filter=firestore.FieldFilter("timestamp", "<", until))
+        query = (
+            query.order_by("timestamp", direction=firestore.Query.DESCENDING)
+            .order_by("__name__", direction=firestore.Query.DESCENDING)
+        )
+        if cursor:
+            timestamp, path = cursor
+            query = query.start_after({"timestamp": timestamp, "__name__": self.db.document(path)})
+        docs = list(query.limit(page_size + 1).stream())
+        next_cursor = None
+        if len(docs) > page_size:
+            docs = docs[:page_size]
+            next_cursor = (docs[-1].get("timestamp"), docs[-1].reference.path)
+        return [doc.to_dict() for doc in docs], next_cursor
+
+    def _compact_admin_logs_txn(self, transaction, before):
+        query = (
+            self.db.collection("admin_logs")
+            .where(filter=firestore.FieldFilter("timestamp", "<", before))
+            .order_by("timestamp")
+            .limit(LOG_COMPACT_CHUNK)
+        )
+        # Reading the logs in the transaction means two compactors racing
+        # over the same logs can't both count them.
+        docs = list(transaction.get(query))
+        rollups = {}
+        for doc in docs:
+            d = doc.to_dict()
+            day = _utc(d["timestamp"]).date().isoformat()
+            by_action = rollups.setdefault(day, {}).setdefault(d.get("admin_user") or "unknown", {})
+            action = d.get("action") or "unknown"
+            by_action[action] = by_action.get(action, 0) + 1
+            transaction.delete(doc.reference)
+        for day, counts in rollups.items():
+            transaction.set(self.db.collection("admin_log_rollups").document(day), {
+                "day": day,
+                "count": firestore.Increment(sum(n for by_action in counts.values() for n in by_action.values())),
+                "counts": {admin: {action: firestore.Increment(n) for action, n in by_action.items()}
+                           for admin, by_action in counts.items()}
+            }, merge=True)
+        return len(docs)
+
+    def compact_admin_logs(self, before):
+        num_compacted = 0
+        while True:
+            n = firestore.transactional(self._compact_admin_logs_txn)(self.db.transaction(), before)
+            num_compacted += n
+            if n < LOG_COMPACT_CHUNK:
+                return num_compacted
+
+    def admin_log_rollups(self, since=None, until=None):
+        query = self.db.collection("admin_log_rollups")
+        if since:
+            query = query.where(filter=firestore.FieldFilter("day", ">=", _utc(since).date().isoformat()))
+        if until:
+            query = query.where(filter=firestore.FieldFilter("day", "<", _utc(until).date().isoformat()))
+        rows = []
+        for doc in query.order_by("day", direction=firestore.Query.DESCENDING).stream():
+            d = doc.to_dict()
+            for admin, by_action in sorted(d.get("counts", {}).items()):
+                for action, n in sorted(by_action.items()):
+                    rows.append({"day": d["day"], "admin_user": admin, "action": action, "count": int(n)})
+        return rows
+
+    # --- admin totals ---
+    def _admin_totals_ref(self, admin_user):
+        return self.db.collection("admin_totals").document(admin_user)
+
+    @staticmethod
+    def _sum_admin_totals(snaps):
+        norm, inst = 0.0, 0.0
+        for snap in snaps:
+            if snap.exists:
+                data = snap.to_dict()
+                norm += data.get("total_normal_value", 0.0)
+                inst += data.get("total_instant_value", 0.0)
+        return norm, inst
+
+    def get_admin_totals(self, admin_user):
+        ref = self._admin_totals_ref(admin_user)
+        snaps = [ref.get()]
+        if self.admin_total_shards.get(admin_user, 1) > 1:
+            snaps += list(ref.collection("shards").stream())
+        return self._sum_admin_totals(snaps)
+
+    def _apply_admin_totals_delta(self, writer, admin_user, normal_add=0.0, instant_add=0.0):
+        # Server-side increments: no read, and concurrent writers never lose updates.
+        ref = self._admin_totals_ref(admin_user)
+        num_shards = self.admin_total_shards.get(admin_user, 1)
+        if num_shards > 1:
+            ref = ref.collection("shards").document(str(random.randrange(num_shards)))
+        writer.set(ref, {
+            "total_normal_value": firestore.Increment(normal_add),
+            "total_instant_value": firestore.Increment(instant_add)
+        }, merge=True)
+
+    def increment_admin_totals(self, admin_user, normal_add=0.0, instant_add=0.0):
+        batch = self.db.batch()
+        self._apply_admin_totals_delta(batch, admin_user, normal_add, instant_add)
+        batch.commit()
+
+    def _reset_admin_totals_txn(self, transaction, admin_user):
+        ref = self._admin_totals_ref(admin_user)
+        # Always read the shards here, so shards left over from an older
+        # shard setting are cleared as well. Transaction.get() takes a
+        # document or a Query, not a CollectionReference.
+        shard_snaps = list(transaction.get(ref.collection("shards").order_by("__name__")))
+        norm, inst = self._sum_admin_totals([ref.get(transaction=transaction)] + shard_snaps)
+        transaction.set(ref, {
+            "total_normal_value": 0.0,
+            "total_instant_value": 0.0
+        })
+        for snap in shard_snaps:
+            transaction.delete(snap.reference)
+        return norm, inst
+
+    def reset_admin_totals(self, admin_user):
+        return firestore.transactional(self._reset_admin_totals_txn)(self.db.transaction(), admin_user)
+
+    # --- aggregates ---
+    def _aggregate_ref(self, item):
+        return self.db.collection("item_aggregates").document(item)
+
+    def _apply_aggregate_deltas(self, writer, item, user_deltas):
+        # One merge write per item for {user: (qty, value)} deltas. writer is
+        # a WriteBatch or Transaction; both take set(..., merge=True).
+        writer.set(self._aggregate_ref(item), {
+            "item": item,
+            "total_qty": firestore.Increment(sum(qty for qty, _ in user_deltas.values())),
+            "total_value": firestore.Increment(sum(value for _, value in user_deltas.values())),
+            "users": {user: firestore.Increment(qty) for user, (qty, _) in user_deltas.items()}
+        }, merge=True)
+
+    def item_aggregates(self):
+        return {doc.id: _firestore_aggregate(doc) for doc in self.db.collection("item_aggregates").stream()}
+
+    def _apply_rollup_deltas(self, writer, day, item_deltas):
+        # One merge write per day for {item: (qty, value)} deltas.
+        writer.set(self.db.collection("deposit_rollups").document(day), {
+            "day": day,
+            "items": {item: {"qty": firestore.Increment(qty), "value": firestore.Increment(value)}
+                      for item, (qty, value) in item_deltas.items()}
+        }, merge=True)
+
+    def _commit_rollup_deltas(self, day_deltas):
+        # {day: {item: (qty, value)}} in batches, for writes that span many days.
+        days = sorted(day_deltas)
+        for start in range(0, len(days), LOG_WRITE_CHUNK):
+            batch = self.db.batch()
+            for day in days[start:start + LOG_WRITE_CHUNK]:
+                self._apply_rollup_deltas(batch, day, day_deltas[day])
+            batch.commit()
+
+    def deposit_rollups(self, since=None, until=None):
+        query = self.db.collection("deposit_rollups")
+        if since:
+            query = query.where(filter=firestore.FieldFilter("day", ">=", _day(since)))
+        if until:
+            query = query.where(filter=firestore.FieldFilter("day", "<", _day(until)))
+        rows = []
+        for doc in query.order_by("day").stream():
+            d = doc.to_dict()
+            for item, totals in sorted(d.get("items", {}).items()):
+                rows.append({"day": d["day"], "item": item, "qty": int(totals.get("qty", 0)),
+                             "value": float(totals.get("value", 0.0))})
+        return rows
+
+    def ledger_item_totals(self, items, user=None):
+        # One count()/sum() aggregation query per item: Firestore bills one
+        # read per 1000 index entries scanned and transfers no documents.
+        if user:
+            base = self.db.collection("users").document(user).collection("deposits")
+        else:
+            base = self.db.collection_group("deposits")
+        totals = {}
+        try:
+            for item in items:
+                query = base.where(filter=firestore.FieldFilter("item", "==", item))
+                result = query.count(alias="count").sum("qty", alias="total_qty").get()
+                values = {r.alias: r.value for r in result[0]}
+                totals[item] = {"count": int(values["count"]), "total_qty": int(values["total_qty"] or 0)}
+        except (InvalidArgument, MethodNotImplemented):
+            # Emulators and databases without aggregation query support.
+            return super().ledger_item_totals(items, user)
+        return totals
+
+    def rebuild_item_aggregates(self, items):
+        aggregates = {item: _empty_aggregate(item) for item in items}
+        rollups = {}
+        num_deposits = 0
+        for dep in self.db.collection_group("deposits").stream():
+            row = _firestore_deposit_row(dep)
+            if row.get("item"):
+                _add_to_aggregates(aggregates, row)
+                if row.get("timestamp"):
+                    qty = int(row.get("qty") or 0)
+                    totals = rollups.setdefault(_day(row["timestamp"]), {}).setdefault(row["item"], {"qty": 0, "value": 0.0})
+                    totals["qty"] += qty
+                    totals["value"] += float(row.get("value") or 0.0) * qty
+                num_deposits += 1
+        batch = self.db.batch()
+        for item, agg in aggregates.items():
+            batch.set(self._aggregate_ref(item), agg)
+        batch.commit()
+        # Rollups are rewritten whole; days left without deposits are dropped.
+        rollups_ref = self.db.collection("deposit_rollups")
+        writes = [(rollups_ref.document(day), {"day": day, "items": by_item}) for day, by_item in rollups.items()]
+        writes += [(doc.reference, None) for doc in rollups_ref.select(["day"]).stream() if doc.id not in rollups]
+        for start in range(0, len(writes), LOG_WRITE_CHUNK):
+            batch = self.db.batch()
+            for ref, data in writes[start:start + LOG_WRITE_CHUNK]:
+                if data is None:
+                    batch.delete(ref)
+                else:
+                    batch.set(ref, data)
+            batch.commit()
+        return num_deposits
+
+    # --- ledger writes ---
+    def submit_deposits(self, user, admin_user, item_values, instant_sell, submission_id, log_entry):
+        # One WriteBatch. submissions/{submission_id} is create()d, so
+        # replaying the same id fails the whole batch with AlreadyExists
+        # instead of duplicating the ledger.
+        now = datetime.utcnow()
+        batch = self.db.batch()
+        batch.create(self.db.collection("submissions").document(submission_id), {
+            "admin_user": admin_user,
+            "user": None if instant_sell else user,
+            "instant_sell": instant_sell,
+            "timestamp": now
+        })
+        if instant_sell:
+            entries_ref = self.db.collection("instant_sells").document(admin_user).collection("entries")
+        else:
+            user_ref = self.db.collection("users").document(user)
+            batch.set(user_ref, {}, merge=True)
+            entries_ref = user_ref.collection("deposits")
+        total_value = 0.0
+        for item, (qty, value) in item_values.items():
+            batch.set(entries_ref.document(), {
+                "item": item,
+                "qty": qty,
+                "value": value,
+                "timestamp": now
+            })
+            if not instant_sell:
+                self._apply_aggregate_deltas(batch, item, {user: (qty, value * qty)})
+            total_value += value * qty
+        if not instant_sell:
+            self._apply_rollup_deltas(batch, _day(now), {item: (qty, value * qty)
+                                                         for item, (qty, value) in item_values.items()})
+        if instant_sell:
+            self._apply_admin_totals_delta(batch, admin_user, normal_add=0.0, instant_add=total_value)
+        else:
+            self._apply_admin_totals_delta(batch, admin_user, normal_add=total_value, instant_add=0.0)
+        batch.set(self.db.collection("admin_logs").document(), log_entry)
+        try:
+            batch.commit()
+        except AlreadyExists:
+            return "duplicate"
+        return "added"
+
+    def _import_chunk(self, admin_user, chunk, submission_id):
+        now = datetime.utcnow()
+        batch = self.db.batch()
+        batch.create(self.db.collection("submissions").document(submission_id), {
+            "admin_user": admin_user,
+            "user": None,
+            "instant_sell": False,
+            "num_deposits": len(chunk),
+            "timestamp": now
+        })
+        deltas = {}
+        day_deltas = {}
+        total_value = 0.0
+        for user in {user for user, _, _, _ in chunk}:
+            batch.set(self.db.collection("users").document(user), {}, merge=True)
+        for user, item, qty, value in chunk:
+            batch.set(self.db.collection("users").document(user).collection("deposits").document(), {
+                "item": item,
+                "qty": qty,
+                "value": value,
+                "timestamp": now
+            })
+            delta = deltas.setdefault(item, {}).setdefault(user, [0, 0.0])
+            delta[0] += qty
+            delta[1] += value * qty
+            day_delta = day_deltas.setdefault(item, [0, 0.0])
+            day_delta[0] += qty
+            day_delta[1] += value * qty
+            total_value += value * qty
+        for item, user_deltas in deltas.items():
+            self._apply_aggregate_deltas(batch, item, user_deltas)
+        self._apply_rollup_deltas(batch, _day(now), day_deltas)
+        self._apply_admin_totals_delta(batch, admin_user, normal_add=total_value, instant_add=0.0)
+        try:
+            batch.commit()
+        except AlreadyExists:
+            return False
+        return True
+
+    def _delete_deposits_txn(self, transaction, keys):
+        refs = [self.db.collection("users").document(user).collection("deposits").document(deposit_id)
+                for user, deposit_id in keys]
+        snaps = [snap for snap in transaction.get_all(refs) if snap.exists]
+        deltas = {}
+        day_deltas = {}
+        for snap in snaps:
+            d = snap.to_dict()
+            user = snap.reference.parent.parent.id
+            transaction.delete(snap.reference)
+            if d.get("item"):
+                qty = int(d.get("qty") or 0)
+                delta = deltas.setdefault(d["item"], {}).setdefault(user, [0, 0.0])
+                delta[0] -= qty
+                delta[1] -= float(d.get("value") or 0.0) * qty
+                if d.get("timestamp"):
+                    day_delta = day_deltas.setdefault(_day(d["timestamp"]), {}).setdefault(d["item"], [0, 0.0])
+                    day_delta[0] -= qty
+                    day_delta[1] -= float(d.get("value") or 0.0) * qty
+        for item, user_deltas in deltas.items():
+            self._apply_aggregate_deltas(transaction, item, user_deltas)
+        for day, item_deltas in day_deltas.items():
+            self._apply_rollup_deltas(transaction, day, item_deltas)
+        return len(snaps)
+
+    def delete_deposits(self, keys):
+        # Two writes per deposit plus at most one per item and one per day
+        # keeps each chunk under Firestore's 500 writes per transaction.
+        num_deleted = 0
+        for start in range(0, len(keys), 150):
+            num_deleted += firestore.transactional(self._delete_deposits_txn)(
+                self.db.transaction(), keys[start:start + 150]
+            )
+        return num_deleted
+
+    def _find_item_deposits(self, item):
+        return list(
+            self.db.collection_group("deposits")
+            .where(filter=firestore.FieldFilter("item", "==", item))
+            .stream()
+        )
+
+    def delete_item_deposits(self, item, admin_user, dry_run=False, progress=None):
+        deposits = self._find_item_deposits(item)
+        if dry_run or not deposits:
+            return len(deposits), 0, None
+
+        deleted_paths = set()
+        failed = []
+        lock = threading.Lock()
+
+        def on_success(reference, result, bulk_writer):
+            with lock:
+                deleted_paths.add(reference.path)
+
+        def on_error(failure, bulk_writer):
+            if failure.attempts < DELETE_MAX_ATTEMPTS:
+                return True
+            with lock:
+                failed.append(failure)
+            return False
+
+        bulk_writer = self.db.bulk_writer(BulkWriterOptions(retry=BulkRetry.exponential))
+        bulk_writer.on_write_error(on_error)
+
+        # deposit_archive/{archive_id} + rows/{deposit_id}, flushed before
+        # anything is deleted.
+        archive_ref = self.db.collection("deposit_archive").document()
+        bulk_writer.set(archive_ref, {
+            "item": item,
+            "admin_user": admin_user,
+            "num_deposits": len(deposits),
+            "archived_at": datetime.utcnow()
+        })
+        for dep in deposits:
+            row = _firestore_deposit_row(dep)
+            row["path"] = dep.reference.path
+            bulk_writer.set(archive_ref.collection("rows").document(dep.id), row)
+        bulk_writer.flush()
+        if failed:
+            bulk_writer.close()
+            raise ArchiveFailed(
+                f"Archiving failed for {len(failed)} rows ({failed[0].message}); nothing was deleted.",
+                len(deposits)
+            )
+
+        bulk_writer.on_write_result(on_success)
+        for start in range(0, len(deposits), DELETE_CHUNK_SIZE):
+            for dep in deposits[start:start + DELETE_CHUNK_SIZE]:
+                bulk_writer.delete(dep.reference)
+            bulk_writer.flush()
+            if progress:
+                progress(len(deleted_paths) + len(failed), len(deposits))
+        bulk_writer.close()
+
+        # Subtract only what was actually removed, so the aggregate stays
+        # right even if some deletes ran out of retries.
+        removed = {}
+        removed_by_day = {}
+        for dep in deposits:
+            if dep.reference.path in deleted_paths:
+                row = _firestore_deposit_row(dep)
+                qty = int(row.get("qty") or 0)
+                r = removed.setdefault(row["user"], [0, 0.0])
+                r[0] += qty
+                r[1] += float(row.get("value") or 0.0) * qty
+                if row.get("timestamp"):
+                    d = removed_by_day.setdefault(_day(row["timestamp"]), [0, 0.0])
+                    d[0] += qty
+                    d[1] += float(row.get("value") or 0.0) * qty
+        if removed:
+            batch = self.db.batch()
+            self._apply_aggregate_deltas(batch, item, {user: (-qty, -value) for user, (qty, value) in removed.items()})
+            batch.commit()
+            self._commit_rollup_deltas({day: {item: (-qty, -value)} for day, (qty, value) in removed_by_day.items()})
+        return len(deposits), len(deleted_paths), archive_ref.id
+
+    # --- ledger reads ---
+    def all_deposits(self):
+        return [_firestore_deposit_row(dep) for dep in self.db.collection_group("deposits").stream()]
+
+    def page_deposits(self, item=None, user=None, since=None, until=None, newest_first=True,
+                      page_size=50, cursor=None):
+        # Collection-group pages filtered on item need a composite
+        # collection-group index on (item, timestamp, __name__).
+        if user:
+            query = self.db.collection("users").document(user).collection("deposits")
+        else:
+            query = self.db.collection_group("deposits")
+        if item:
+            query = query.where(filter=firestore.FieldFilter("item", "==", item))
+        if since:
+            query = query.where(filter=firestore.FieldFilter("timestamp", ">=", since))
+        if until:
+            query = query.where(filter=firestore.FieldFilter("timestamp", "<", until))
+        direction = firestore.Query.DESCENDING if newest_first else firestore.Query.ASCENDING
+        query = query.order_by("timestamp", direction=direction).order_by("__name__", direction=direction)
+        if cursor:
+            timestamp, path = cursor
+            query = query.start_after({"timestamp": timestamp, "__name__": self.db.document(path)})
+        # One extra document tells us whether there is a next page.
+        docs = list(query.limit(page_size + 1).stream())
+        next_cursor = None
+        if len(docs) > page_size:
+            docs = docs[:page_size]
+            next_cursor = (docs[-1].get("timestamp"), docs[-1].reference.path)
+        return [_firestore_deposit_row(doc) for doc in docs], next_cursor
+
+    def page_instant_sells(self, admin_user=None, newest_first=True, page_size=50, cursor=None):
+        # Without admin_user this is a collection group over every admin's
+        # entries, ordered on (timestamp, __name__).
+        if admin_user:
+            query = self.db.collection("instant_sells").document(admin_user).collection("entries")
+        else:
+            query = self.db.collection_group("entries")
+        direction = firestore.Query.DESCENDING if newest_first else firestore.Query.ASCENDING
+        query = query.order_by("timestamp", direction=direction).order_by("__name__", direction=direction)
+        if cursor:
+            timestamp, path = cursor
+            query = query.start_after({"timestamp": timestamp, "__name__": self.db.document(path)})
+        docs = list(query.limit(page_size + 1).stream())
+        next_cursor = None
+        if len(docs) > page_size:
+            docs = docs[:page_size]
+            next_cursor = (docs[-1].get("timestamp"), docs[-1].reference.path)
+        rows = []
+        for doc in docs:
+            d = doc.to_dict()
+            # instant_sells/{admin}/entries/{id}
+            d["admin_user"] = doc.reference.parent.parent.id
+            d["id"] = doc.id
+            rows.append(d)
+        return rows, next_cursor
+
+    # --- change listeners ---
+    def watch_item_aggregates(self, on_change):
+        def callback(docs, changes, read_time):
+            on_change({doc.id: _firestore_aggregate(doc) for doc in docs})
+        return self.db.collection("item_aggregates").on_snapshot(callback)
+
+    def watch_item_settings(self, on_change):
+        def callback(docs, changes, read_time):
+            on_change(docs[0].to_dict() if docs and docs[0].exists else None)
+        return self.db.collection("meta").document("item_settings").on_snapshot(callback)
+
+
+# --- SQLITE ---
+
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS deposits (
+    id TEXT PRIMARY KEY,
+    user TEXT NOT NULL,
+    item TEXT NOT NULL,
+    qty INTEGER NOT NULL,
+    value REAL NOT NULL,
+    timestamp REAL NOT NULL
+);
+DROP INDEX IF EXISTS deposits_item;
+CREATE INDEX IF NOT EXISTS deposits_item_timestamp ON deposits (item, timestamp);
+CREATE INDEX IF NOT EXISTS deposits_timestamp ON deposits (timestamp);
+CREATE INDEX IF NOT EXISTS deposits_user ON deposits (user, timestamp);
+CREATE TABLE IF NOT EXISTS instant_sells (
+    id TEXT PRIMARY KEY,
+    admin_user TEXT NOT NULL,
+    item TEXT NOT NULL,
+    qty INTEGER NOT NULL,
+    value REAL NOT NULL,
+    timestamp REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS instant_sells_admin ON instant_sells (admin_user, timestamp);
+CREATE INDEX IF NOT EXISTS instant_sells_timestamp ON instant_sells (timestamp);
+CREATE TABLE IF NOT EXISTS item_aggregates (
+    item TEXT NOT NULL,
+    user TEXT NOT NULL,
+    qty INTEGER NOT NULL DEFAULT 0,
+    value REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (item, user)
+);
+CREATE TABLE IF NOT EXISTS admin_totals (
+    admin_user TEXT PRIMARY KEY,
+    total_normal_value REAL NOT NULL DEFAULT 0,
+    total_instant_value REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS admin_logs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp REAL NOT NULL,
+    admin_user TEXT,
+    action TEXT,
+    details TEXT,
+    data TEXT
+);
+CREATE INDEX IF NOT EXISTS admin_logs_timestamp ON admin_logs (timestamp);
+CREATE INDEX IF NOT EXISTS admin_logs_admin_user ON admin_logs (admin_user, timestamp);
+CREATE INDEX IF NOT EXISTS admin_logs_action ON admin_logs (action, timestamp);
+CREATE TABLE IF NOT EXISTS admin_log_rollups (
+    day TEXT NOT NULL,
+    admin_user TEXT NOT NULL,
+    action TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (day, admin_user, action)
+);
+CREATE TABLE IF NOT EXISTS submissions (
+    id TEXT PRIMARY KEY,
+    admin_user TEXT,
+    user TEXT,
+    instant_sell INTEGER NOT NULL,
+    timestamp REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS deposit_archive (
+    id TEXT PRIMARY KEY,
+    item TEXT NOT NULL,
+    admin_user TEXT,
+    num_deposits INTEGER NOT NULL,
+    archived_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS deposit_archive_rows (
+    archive_id TEXT NOT NULL,
+    id TEXT NOT NULL,
+    user TEXT NOT NULL,
+    item TEXT NOT NULL,
+    qty INTEGER NOT NULL,
+    value REAL NOT NULL,
+    timestamp REAL NOT NULL,
+    PRIMARY KEY (archive_id, id)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS item_settings_history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp REAL NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS item_settings_history_timestamp ON item_settings_history (timestamp);
+CREATE TABLE IF NOT EXISTS deposit_rollups (
+    day TEXT NOT NULL,
+    item TEXT NOT NULL,
+    qty INTEGER NOT NULL DEFAULT 0,
+    value REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, item)
+);
+"""
+
+
+def _ts(dt):
+    return _utc(dt).timestamp()
+
+
+def _dt(ts):
+    return datetime.fromtimestamp(ts, timezone.utc)
+
+
+def _new_id():
+    return uuid.uuid4().hex[:20]
+
+
+class SQLiteBackend(StorageBackend):
+    # Same semantics as FirestoreBackend on one SQLite database; every
+    # multi-row write is a single transaction. path=":memory:" keeps
+    # everything in-process. One connection is shared by all Streamlit
+    # session threads, serialized by a lock.
+
+    def __init__(self, path=":memory:"):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._migrate()
+        self._conn.executescript(_SQLITE_SCHEMA)
+        self._backfill()
+
+    def _backfill(self):
+        # Tables derived from the ledger or the settings that a database
+        # older than them starts without. Every deposit write adds a rollup
+        # row, so a ledger without any rollups was never rolled up.
+        with self._lock, self._conn:
+            if (self._conn.execute("SELECT 1 FROM deposit_rollups LIMIT 1").fetchone() is None
+                    and self._conn.execute("SELECT 1 FROM deposits LIMIT 1").fetchone() is not None):
+                self._conn.execute(
+                    "INSERT INTO deposit_rollups (day, item, qty, value) "
+                    "SELECT date(timestamp, 'unixepoch'), item, SUM(qty), SUM(qty * value) FROM deposits GROUP BY 1, 2"
+                )
+            self._seed_item_settings_history()
+
+    def _migrate(self):
+        # Columns added after a table was first created; CREATE TABLE IF NOT
+        # EXISTS leaves existing tables alone.
+        columns = {r["name"] for r in self._conn.execute("PRAGMA table_info(admin_logs)")}
+        if columns and "data" not in columns:
+            self._conn.execute("ALTER TABLE admin_logs ADD COLUMN data TEXT")
+        # Deletion tombstones had no reader.
+        self._conn.execute("DROP TABLE IF EXISTS deposit_tombstones")
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    # --- settings ---
+    def load_item_settings(self):
+        rows = self._query("SELECT value FROM meta WHERE key = 'item_settings'")
+        return json.loads(rows[0]["value"]) if rows else None
+
+    def _seed_item_settings_history(self):
+        # Settings stored before the history existed become its first
+        # version; call with the lock held, inside a transaction.
+        stored = self._conn.execute("SELECT value FROM meta WHERE key = 'item_settings'").fetchone()
+        if stored is not None and self._conn.execute("SELECT 1 FROM item_settings_history LIMIT 1").fetchone() is None:
+            stored = json.loads(stored["value"])
+            self._conn.execute(
+                "INSERT INTO item_settings_history (timestamp, data) VALUES (?, ?)",
+                (_ts(SETTINGS_HISTORY_START), json.dumps({key: stored.get(key) for key in
+                                                          ("targets", "divines", "bank_buy_pct")}))
+            )
+
+    def save_item_settings(self, targets, divines, bank_buy_pct):
+        with self._lock, self._conn:
+            self._seed_item_settings_history()
+            # merge=True semantics: keys not passed keep their old values.
+            data = self.load_item_settings() or {}
+            data.update({"targets": targets, "divines": divines, "bank_buy_pct": bank_buy_pct})
+            self._conn.execute(
+                "INSERT INTO item_settings_history (timestamp, data) VALUES (?, ?)",
+                (_ts(datetime.now(timezone.utc)),
+                 json.dumps({"targets": targets, "divines": divines, "bank_buy_pct": bank_buy_pct}))
+            )
+            self._conn.execute(
+                "INSERT INTO meta (key, value) VALUES ('item_settings', ?) "
+                "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+                (json.dumps(data),)
+            )
+
+    def item_settings_history(self, since=None):
+        rows = self._query(
+            "SELECT timestamp, data FROM item_settings_history "
+            + ("WHERE timestamp >= ? " if since else "") + "ORDER BY timestamp, id",
+            (_ts(since),) if since else ()
+        )
+        return [dict(json.loads(r["data"]), timestamp=_dt(r["timestamp"])) for r in rows]
+
+    # --- admin logs ---
+    def _insert_log(self, entry):
+        self._conn.execute(
+            "INSERT INTO admin_logs (timestamp, admin_user, action, details, data) VALUES (?, ?, ?, ?, ?)",
+            (_ts(entry["timestamp"]), entry.get("admin_user"), entry.get("action"), entry.get("details"),
+             json.dumps(entry["data"]) if entry.get("data") is not None else None)
+        )
+
+    def _log_rows(self, rows):
+        return [dict(r, timestamp=_dt(r["timestamp"]), data=json.loads(r["data"]) if r["data"] else None)
+                for r in rows]
+
+    def add_admin_log(self, entry):
+        with self._lock, self._conn:
+            self._insert_log(entry)
+
+    def add_admin_logs(self, entries):
+        # One local transaction: it either commits or raises, never both.
+        with self._lock, self._conn:
+            for _, entry in entries:
+                self._insert_log(entry)
+        return len(entries)
+
+    def recent_admin_logs(self, n):
+        return self._log_rows(self._query(
+            "SELECT timestamp, admin_user, action, details, data FROM admin_logs "
+            "ORDER BY timestamp DESC, id DESC LIMIT ?", (n,)
+        ))
+
+    def page_admin_logs(self, admin_user=None, action=None, since=None, until=None, page_size=30, cursor=None):
+        where, params = [], []
+        if admin_user:
+            where.append("admin_user = ?")
+            params.append(admin_user)
+        if action:
+            where.append("action = ?")
+            params.append(action)
+        if since:
+            where.append("timestamp >= ?")
+            params.append(_ts(since))
+        if until:
+            where.append("timestamp < ?")
+            params.append(_ts(until))
+        if cursor:
+            where.append("(timestamp, id) < (?, ?)")
+            params.extend(cursor)
+        rows = self._query(
+            "SELECT id, timestamp, admin_user, action, details, data FROM admin_logs "
+            + (f"WHERE {' AND '.join(where)} " if where else "")
+            + "ORDER BY timestamp DESC, id DESC LIMIT ?",
+            params + [page_size + 1]
+        )
+        next_cursor = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            next_cursor = (rows[-1]["timestamp"], rows[-1]["id"])
+        return [{k: v for k, v in r.items() if k != "id"} for r in self._log_rows(rows)], next_cursor
+
+    def compact_admin_logs(self, before):
+        with self._lock, self._conn:
+            before_ts = _ts(before)
+            self._conn.execute(
+                "INSERT INTO admin_log_rollups (day, admin_user, action, count) "
+                "SELECT date(timestamp, 'unixepoch'), COALESCE(admin_user, 'unknown'), "
+                "COALESCE(action, 'unknown'), COUNT(*) FROM admin_logs WHERE timestamp < ? "
+                "GROUP BY 1, 2, 3 "
+                "ON CONFLICT (day, admin_user, action) DO UPDATE SET count = count + excluded.count",
+                (before_ts,)
+            )
+            return self._conn.execute("DELETE FROM admin_logs WHERE timestamp < ?", (before_ts,)).rowcount
+
+    def admin_log_rollups(self, since=None, until=None):
+        where, params = [], []
+        if since:
+            where.append("day >= ?")
+            params.append(_utc(since).date().isoformat())
+        if until:
+            where.append("day < ?")
+            params.append(_utc(until).date().isoformat())
+        return [dict(r) for r in self._query(
+            "SELECT day, admin_user, action, count FROM admin_log_rollups "
+            + (f"WHERE {' AND '.join(where)} " if where else "")
+            + "ORDER BY day DESC, admin_user, action",
+            params
+        )]
+
+    # --- admin totals ---
+    def get_admin_totals(self, admin_user):
+        rows = self._query(
+            "SELECT total_normal_value, total_instant_value FROM admin_totals WHERE admin_user = ?",
+            (admin_user,)
+        )
+        return (rows[0]["total_normal_value"], rows[0]["total_instant_value"]) if rows else (0.0, 0.0)
+
+    def _increment_admin_totals(self, admin_user, normal_add, instant_add):
+        self._conn.execute(
+            "INSERT INTO admin_totals (admin_user, total_normal_value, total_instant_value) VALUES (?, ?, ?) "
+            "ON CONFLICT (admin_user) DO UPDATE SET "
+            "total_normal_value = total_normal_value + excluded.total_normal_value, "
+            "total_instant_value = total_instant_value + excluded.total_instant_value",
+            (admin_user, normal_add, instant_add)
+        )
+
+    def increment_admin_totals(self, admin_user, normal_add=0.0, instant_add=0.0):
+        with self._lock, self._conn:
+            self._increment_admin_totals(admin_user, normal_add, instant_add)
+
+    def reset_admin_totals(self, admin_user):
+        with self._lock, self._conn:
+            before = self.get_admin_totals(admin_user)
+            self._conn.execute(
+                "UPDATE admin_totals SET total_normal_value = 0, total_instant_value = 0 WHERE admin_user = ?",
+                (admin_user,)
+            )
+            return before
+
+    # --- aggregates ---
+    def _apply_aggregate_delta(self, item, user, qty, value):
+        self._conn.execute(
+            "INSERT INTO item_aggregates (item, user, qty, value) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (item, user) DO UPDATE SET qty = qty + excluded.qty, value = value + excluded.value",
+            (item, user, qty, value)
+        )
+
+    def _apply_rollup_delta(self, day, item, qty, value):
+        self._conn.execute(
+            "INSERT INTO deposit_rollups (day, item, qty, value) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (day, item) DO UPDATE SET qty = qty + excluded.qty, value = value + excluded.value",
+            (day, item, qty, value)
+        )
+
+    def deposit_rollups(self, since=None, until=None):
+        where, params = [], []
+        if since:
+            where.append("day >= ?")
+            params.append(_day(since))
+        if until:
+            where.append("day < ?")
+            params.append(_day(until))
+        return [dict(r) for r in self._query(
+            "SELECT day, item, qty, value FROM deposit_rollups "
+            + (f"WHERE {' AND '.join(where)} " if where else "")
+            + "ORDER BY day, item",
+            params
+        )]
+
+    def item_aggregates(self):
+        aggregates = {}
+        for r in self._query("SELECT item, user, qty, value FROM item_aggregates"):
+            agg = aggregates.setdefault(r["item"], _empty_aggregate(r["item"]))
+            agg["total_qty"] += r["qty"]
+            agg["total_value"] += r["value"]
+            if r["qty"] > 0:
+                agg["users"][r["user"]] = r["qty"]
+        return aggregates
+
+    def ledger_item_totals(self, items, user=None):
+        totals = {item: {"count": 0, "total_qty": 0} for item in items}
+        rows = self._query(
+            "SELECT item, COUNT(*) AS count, SUM(qty) AS total_qty FROM deposits "
+            + ("WHERE user = ? " if user else "") + "GROUP BY item",
+            (user,) if user else ()
+        )
+        for r in rows:
+            if r["item"] in totals:
+                totals[r["item"]] = {"count": r["count"], "total_qty": r["total_qty"] or 0}
+        return totals
+
+    def rebuild_item_aggregates(self, items):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM item_aggregates")
+            self._conn.execute(
+                "INSERT INTO item_aggregates (item, user, qty, value) "
+                "SELECT item, user, SUM(qty), SUM(qty * value) FROM deposits GROUP BY item, user"
+            )
+            self._conn.execute("DELETE FROM deposit_rollups")
+            self._conn.execute(
+                "INSERT INTO deposit_rollups (day, item, qty, value) "
+                "SELECT date(timestamp, 'unixepoch'), item, SUM(qty), SUM(qty * value) FROM deposits GROUP BY 1, 2"
+            )
+            return self._conn.execute("SELECT COUNT(*) FROM deposits").fetchone()[0]
+
+    # --- ledger writes ---
+    def submit_deposits(self, user, admin_user, item_values, instant_sell, submission_id, log_entry):
+        now = _ts(datetime.now(timezone.utc))
+        with self._lock:
+            try:
+                with self._conn:
+                    self._conn.execute(
+                        "INSERT INTO submissions (id, admin_user, user, instant_sell, timestamp) VALUES (?, ?, ?, ?, ?)",
+                        (submission_id, admin_user, None if instant_sell else user, int(instant_sell), now)
+                    )
+                    total_value = 0.0
+                    for item, (qty, value) in item_values.items():
+                        if instant_sell:
+                            self._conn.execute(
+                                "INSERT INTO instant_sells (id, admin_user, item, qty, value, timestamp) VALUES (?, ?, ?, ?, ?, ?)",
+                                (_new_id(), admin_user, item, qty, value, now)
+                            )
+                        else:
+                            self._conn.execute(
+                                "INSERT INTO deposits (id, user, item, qty, value, timestamp) VALUES (?, ?, ?, ?, ?, ?)",
+                                (_new_id(), user, item, qty, value, now)
+                            )
+                            self._apply_aggregate_delta(item, user, qty, value * qty)
+                            self._apply_rollup_delta(_day(_dt(now)), item, qty, value * qty)
+                        total_value += value * qty
+                    if instant_sell:
+                        self._increment_admin_totals(admin_user, 0.0, total_value)
+                    else:
+                        self._increment_admin_totals(admin_user, total_value, 0.0)
+                    self._insert_log(log_entry)
+            except sqlite3.IntegrityError:
+                # Only submissions.id can collide: a replayed submission.
+                return "duplicate"
+        return "added"
+
+    def _import_chunk(self, admin_user, chunk, submission_id):
+        now = _ts(datetime.now(timezone.utc))
+        with self._lock:
+            try:
+                with self._conn:
+                    self._conn.execute(
+                        "INSERT INTO submissions (id, admin_user, user, instant_sell, timestamp) VALUES (?, ?, NULL, 0, ?)",
+                        (submission_id, admin_user, now)
+                    )
+                    self._conn.executemany(
+                        "INSERT INTO deposits (id, user, item, qty, value, timestamp) VALUES (?, ?, ?, ?, ?, ?)",
+                        [(_new_id(), user, item, qty, value, now) for user, item, qty, value in chunk]
+                    )
+                    for user, item, qty, value in chunk:
+                        self._apply_aggregate_delta(item, user, qty, value * qty)
+                        self._apply_rollup_delta(_day(_dt(now)), item, qty, value * qty)
+                    self._increment_admin_totals(admin_user, sum(qty * value for _, _, qty, value in chunk), 0.0)
+            except sqlite3.IntegrityError:
+                return False
+        return True
+
+    def delete_deposits(self, keys):
+        num_deleted = 0
+        with self._lock, self._conn:
+            for user, deposit_id in keys:
+                row = self._conn.execute(
+                    "SELECT item, qty, value, timestamp FROM deposits WHERE user = ? AND id = ?", (user, deposit_id)
+                ).fetchone()
+                if row is None:
+                    continue
+                self._conn.execute("DELETE FROM deposits WHERE user = ? AND id = ?", (user, deposit_id))
+                self._apply_aggregate_delta(row["item"], user, -row["qty"], -row["value"] * row["qty"])
+                self._apply_rollup_delta(_day(_dt(row["timestamp"])), row["item"], -row["qty"],
+                                         -row["value"] * row["qty"])
+                num_deleted += 1
+        return num_deleted
+
+    def delete_item_deposits(self, item, admin_user, dry_run=False, progress=None):
+        with self._lock:
+            num_matched = self._conn.execute("SELECT COUNT(*) FROM deposits WHERE item = ?", (item,)).fetchone()[0]
+            if dry_run or not num_matched:
+                return num_matched, 0, None
+            archive_id = _new_id()
+            # One transaction: the archive, the deletes and the aggregate
+            # reset either all land or none do.
+            with self._conn:
+                self._conn.execute(
+                    "INSERT INTO deposit_archive (id, item, admin_user, num_deposits, archived_at) VALUES (?, ?, ?, ?, ?)",
+                    (archive_id, item, admin_user, num_matched, _ts(datetime.now(timezone.utc)))
+                )
+                self._conn.execute(
+                    "INSERT INTO deposit_archive_rows (archive_id, id, user, item, qty, value, timestamp) "
+                    "SELECT ?, id, user, item, qty, value, timestamp FROM deposits WHERE item = ?",
+                    (archive_id, item)
+                )
+                self._conn.execute(
+                    "INSERT INTO deposit_rollups (day, item, qty, value) "
+                    "SELECT date(timestamp, 'unixepoch'), item, -SUM(qty), -SUM(qty * value) FROM deposits "
+                    "WHERE item = ? GROUP BY 1, 2 "
+                    "ON CONFLICT (day, item) DO UPDATE SET qty = qty + excluded.qty, value = value + excluded.value",
+                    (item,)
+                )
+                ids = [r["id"] for r in self._conn.execute("SELECT id FROM deposits WHERE item = ?", (item,))]
+                for start in range(0, len(ids), DELETE_CHUNK_SIZE):
+                    chunk = ids[start:start + DELETE_CHUNK_SIZE]
+                    self._conn.execute(
+                        f"DELETE FROM deposits WHERE id IN ({','.join('?' * len(chunk))})", chunk
+                    )
+                    if progress:
+                        progress(start + len(chunk), len(ids))
+                self._conn.execute("DELETE FROM item_aggregates WHERE item = ?", (item,))
+            return num_matched, num_matched, archive_id
+
+    # --- ledger reads ---
+    def _deposit_rows(self, sql, params=()):
+        return [dict(r, timestamp=_dt(r["timestamp"])) for r in self._query(sql, params)]
+
+    def all_deposits(self):
+        return self._deposit_rows("SELECT user, item, qty, value, timestamp, id FROM deposits")
+
+    def page_deposits(self, item=None, user=None, since=None, until=None, newest_first=True,
+                      page_size=50, cursor=None):
+        where, params = [], []
+        if item:
+            where.append("item = ?")
+            params.append(item)
+        if user:
+            where.append("user = ?")
+            params.append(user)
+        if since:
+            where.append("timestamp >= ?")
+            params.append(_ts(since))
+        if until:
+            where.append("timestamp < ?")
+            params.append(_ts(until))
+        if cursor:
+            # Keyset pagination on (timestamp, id), matching the ORDER BY.
+            where.append("(timestamp, id) < (?, ?)" if newest_first else "(timestamp, id) > (?, ?)")
+            params.extend(cursor)
+        order = "DESC" if newest_first else "ASC"
+        rows = self._query(
+            "SELECT user, item, qty, value, timestamp, id FROM deposits "
+            + (f"WHERE {' AND '.join(where)} " if where else "")
+            + f"ORDER BY timestamp {order}, id {order} LIMIT ?",
+            params + [page_size + 1]
+        )
+        next_cursor = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            # The raw REAL timestamp, so the cursor can't drift by a rounded microsecond.
+            next_cursor = (rows[-1]["timestamp"], rows[-1]["id"])
+        return [dict(r, timestamp=_dt(r["timestamp"])) for r in rows], next_cursor
+
+    def page_instant_sells(self, admin_user=None, newest_first=True, page_size=50, cursor=None):
+        where, params = [], []
+        if admin_user:
+            where.append("admin_user = ?")
+            params.append(admin_user)
+        if cursor:
+            where.append("(timestamp, id) < (?, ?)" if newest_first else "(timestamp, id) > (?, ?)")
+            params.extend(cursor)
+        order = "DESC" if newest_first else "ASC"
+        rows = self._query(
+            "SELECT admin_user, item, qty, value, timestamp, id FROM instant_sells "
+            + (f"WHERE {' AND '.join(where)} " if where else "")
+            + f"ORDER BY timestamp {order}, id {order} LIMIT ?",
+            params + [page_size + 1]
+        )
+        next_cursor = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            next_cursor = (rows[-1]["timestamp"], rows[-1]["id"])
+        return [dict(r, timestamp=_dt(r["timestamp"])) for r in rows], next_cursor
@@ -0,0 +1,147 @@
+import copy
+import os
+import sys
+import threading
+from datetime import datetime, timezone
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeFirestoreAPI:
+    # Stands in for the Firestore GAPIC client under a real
+    # google.cloud.firestore Client, so references, queries, batches,
+    # transactions and Increment transforms go through the library's own
+    # code. Commits apply atomically; transactions don't isolate reads.
+    # Queries support a plain collection listing, with order_by and limit.
+
+    def __init__(self):
+        self.docs = {}
+        self._lock = threading.Lock()
+        self._txn = 0
+
+    def _now(self):
+        from google.protobuf import timestamp_pb2
+        ts = timestamp_pb2.Timestamp()
+        ts.FromDatetime(datetime.now(timezone.utc))
+        return ts
+
+    def _document(self, name):
+        from google.cloud.firestore_v1 import _helpers
+        from google.cloud.firestore_v1.types import document
+        now = self._now()
+        return document.Document(name=name, fields=_helpers.encode_dict(self.docs[name]),
+                                 create_time=now, update_time=now)
+
+    @staticmethod
+    def _set_path(data, parts, value):
+        for part in parts[:-1]:
+            data = data.setdefault(part, {})
+        data[parts[-1]] = value
+
+    @staticmethod
+    def _get_path(data, parts):
+        for part in parts:
+            if not isinstance(data, dict) or part not in data:
+                return None
+            data = data[part]
+        return data
+
+    def _apply(self, write):
+        from google.api_core.exceptions import AlreadyExists, NotFound
+        from google.cloud.firestore_v1 import _helpers
+        from google.cloud.firestore_v1.field_path import FieldPath
+        if "delete" in write:
+            self.docs.pop(write.delete, None)
+            return
+        name = write.update.name
+        if "current_document" in write:
+            if write.current_document.exists and name not in self.docs:
+                raise NotFound(name)
+            if not write.current_document.exists and name in self.docs:
+                raise AlreadyExists(name)
+        fields = _helpers.decode_dict(write.update.fields, None)
+        if "update_mask" in write:
+            data = self.docs.setdefault(name, {})
+            for path in write.update_mask.field_paths:
+                parts = FieldPath.from_api_repr(path).parts
+                self._set_path(data, parts, self._get_path(fields, parts))
+        else:
+            self.docs[name] = data = fields
+        for transform in write.update_transforms:
+            parts = FieldPath.from_api_repr(transform.field_path).parts
+            if "increment" not in transform:
+                raise NotImplementedError(f"transform {transform}")
+            current = self._get_path(data, parts) or 0
+            self._set_path(data, parts, current + _helpers.decode_value(transform.increment, None))
+
+    def commit(self, request, **kwargs):
+        from google.cloud.firestore_v1.types import firestore, write
+        request = firestore.CommitRequest(request)
+        with self._lock:
+            # All or nothing, like the real service.
+            before = copy.deepcopy(self.docs)
+            try:
+                for w in request.writes:
+                    self._apply(w)
+            except Exception:
+                self.docs = before
+                raise
+            now = self._now()
+            return firestore.CommitResponse(write_results=[write.WriteResult(update_time=now)
+                                                           for _ in request.writes], commit_time=now)
+
+    def batch_get_documents(self, request, **kwargs):
+        from google.cloud.firestore_v1.types import firestore
+        request = firestore.BatchGetDocumentsRequest(request)
+        with self._lock:
+            responses = [firestore.BatchGetDocumentsResponse(found=self._document(name), read_time=self._now())
+                         if name in self.docs else
+                         firestore.BatchGetDocumentsResponse(missing=name, read_time=self._now())
+                         for name in request.documents]
+        return iter(responses)
+
+    def run_query(self, request, **kwargs):
+        from google.cloud.firestore_v1.types import firestore
+        request = firestore.RunQueryRequest(request)
+        query = request.structured_query
+        if "where" in query or len(query.from_) != 1 or query.from_[0].all_descendants:
+            raise NotImplementedError("FakeFirestoreAPI only lists one collection")
+        prefix = f"{request.parent}/{query.from_[0].collection_id}/"
+        from google.cloud.firestore_v1.field_path import FieldPath
+        from google.cloud.firestore_v1.types import query as query_pb
+        with self._lock:
+            names = sorted(name for name in self.docs
+                           if name.startswith(prefix) and "/" not in name[len(prefix):])
+            for order in reversed(query.order_by):
+                if order.field.field_path == "__name__":
+                    key = lambda name: name
+                else:
+                    parts = FieldPath.from_api_repr(order.field.field_path).parts
+                    key = lambda name, parts=parts: self._get_path(self.docs[name], parts)
+                names.sort(key=key, reverse=order.direction == query_pb.StructuredQuery.Direction.DESCENDING)
+            if "limit" in query:
+                names = names[:query.limit]
+            responses = [firestore.RunQueryResponse(document=self._document(name), read_time=self._now())
+                         for name in names]
+        return iter(responses or [firestore.RunQueryResponse(read_time=self._now())])
+
+    def begin_transaction(self, request, **kwargs):
+        from google.cloud.firestore_v1.types import firestore
+        with self._lock:
+            self._txn += 1
+            return firestore.BeginTransactionResponse(transaction=str(self._txn).encode())
+
+    def rollback(self, request, **kwargs):
+        return None
+
+
+@pytest.fixture
+def firestore_client():
+    pytest.importorskip("google.cloud.firestore_v1")
+    from google.auth.credentials import AnonymousCredentials
+    from google.cloud.firestore_v1 import Client
+    client = Client(project="bank-test", credentials=AnonymousCredentials())
+    client._firestore_api_internal = FakeFirestoreAPI()
+    return client
@@ -0,0 +1,84 @@
+import threading
+import uuid
+from datetime import datetime, timezone
+
+import pytest
+
+import storage
+
+THREADS = 16
+PER_THREAD = 25
+
+
+@pytest.fixture(params=["sqlite", "firestore", "firestore-sharded"])
+def make_backend(request, tmp_path, firestore_client):
+    # Returns a factory: every call is a new backend on the same bank, as
+    # separate app processes would each open their own.
+    if request.param == "sqlite":
+        path = str(tmp_path / "bank.sqlite3")
+        storage.SQLiteBackend(path)
+        return lambda: storage.SQLiteBackend(path)
+    shards = {"Diablo": 4} if request.param == "firestore-sharded" else {}
+    return lambda: storage.FirestoreBackend(firestore_client, admin_total_shards=shards)
+
+
+def _hammer(make_backend, fn):
+    errors = []
+
+    def worker():
+        backend = make_backend()
+        try:
+            for _ in range(PER_THREAD):
+                fn(backend)
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=worker) for _ in range(THREADS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors
+
+
+def test_concurrent_increments_are_exact(make_backend):
+    _hammer(make_backend, lambda b: b.increment_admin_totals("Diablo", normal_add=1.0, instant_add=0.5))
+    expected = THREADS * PER_THREAD
+    assert make_backend().get_admin_totals("Diablo") == (float(expected), expected * 0.5)
+    assert make_backend().get_admin_totals("JESUS") == (0.0, 0.0)
+
+
+def test_concurrent_submissions_are_exact(make_backend):
+    log = {"timestamp": datetime.now(timezone.utc), "admin_user": "Diablo", "action": "Instant Sell Added",
+           "details": "test"}
+    _hammer(make_backend, lambda b: b.submit_deposits(None, "Diablo", {"Heavy Belt": (2, 0.25)}, True,
+                                                      uuid.uuid4().hex, dict(log)))
+    expected = THREADS * PER_THREAD
+    assert make_backend().get_admin_totals("Diablo") == (0.0, expected * 0.5)
+
+
+def test_reset_returns_totals_and_zeroes(make_backend):
+    backend = make_backend()
+    for _ in range(10):
+        backend.increment_admin_totals("Diablo", normal_add=1.5, instant_add=0.25)
+    backend.increment_admin_totals("JESUS", normal_add=7.0)
+    assert backend.reset_admin_totals("Diablo") == (15.0, 2.5)
+    assert backend.get_admin_totals("Diablo") == (0.0, 0.0)
+    assert backend.get_admin_totals("JESUS") == (7.0, 0.0)
+    backend.increment_admin_totals("Diablo", normal_add=2.0)
+    assert backend.get_admin_totals("Diablo") == (2.0, 0.0)
+    assert backend.reset_admin_totals("Diablo") == (2.0, 0.0)
+
+
+def test_reset_never_incremented(make_backend):
+    assert make_backend().reset_admin_totals("LT") == (0.0, 0.0)
+    assert make_backend().get_admin_totals("LT") == (0.0, 0.0)
+
+
+def test_reset_clears_shards_left_by_an_older_setting(firestore_client):
+    sharded = storage.FirestoreBackend(firestore_client, admin_total_shards={"Diablo": 4})
+    for _ in range(20):
+        sharded.increment_admin_totals("Diablo", normal_add=1.0)
+    unsharded = storage.FirestoreBackend(firestore_client)
+    assert unsharded.reset_admin_totals("Diablo") == (20.0, 0.0)
+    assert sharded.get_admin_totals("Diablo") == (0.0, 0.0)
+    assert not list(unsharded._admin_totals_ref("Diablo").collection("shards").stream())
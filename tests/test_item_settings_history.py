@@ -0,0 +1,54 @@
+import json
+import sqlite3
+
+import pytest
+
+import storage
+
+OLD = ({"Heavy Belt": 10}, {"Heavy Belt": 2.0}, 0.8)
+NEW = ({"Heavy Belt": 10}, {"Heavy Belt": 5.0}, 0.8)
+
+
+def _store_without_history(backend, targets, divines, bank_buy_pct):
+    # Settings as a bank from before the history existed holds them.
+    data = {"targets": targets, "divines": divines, "bank_buy_pct": bank_buy_pct}
+    if isinstance(backend, storage.SQLiteBackend):
+        with backend._lock, backend._conn:
+            backend._conn.execute("INSERT INTO meta (key, value) VALUES ('item_settings', ?)", (json.dumps(data),))
+    else:
+        backend.db.collection("meta").document("item_settings").set(data)
+
+
+@pytest.fixture(params=["sqlite", "firestore"])
+def backend(request, tmp_path, firestore_client):
+    if request.param == "sqlite":
+        return storage.SQLiteBackend(str(tmp_path / "bank.sqlite3"))
+    return storage.FirestoreBackend(firestore_client)
+
+
+def test_first_save_keeps_older_settings_as_first_version(backend):
+    _store_without_history(backend, *OLD)
+    backend.save_item_settings(*NEW)
+    history = backend.item_settings_history()
+    assert [v["divines"] for v in history] == [OLD[1], NEW[1]]
+    assert history[0]["timestamp"].timestamp() == storage.SETTINGS_HISTORY_START.timestamp()
+
+
+def test_first_save_of_a_new_bank_is_the_only_version(backend):
+    backend.save_item_settings(*NEW)
+    assert [v["divines"] for v in backend.item_settings_history()] == [NEW[1]]
+
+
+def test_later_saves_add_one_version_each(backend):
+    _store_without_history(backend, *OLD)
+    backend.save_item_settings(*NEW)
+    backend.save_item_settings(*OLD)
+    assert [v["divines"] for v in backend.item_settings_history()] == [OLD[1], NEW[1], OLD[1]]
+
+
+def test_sqlite_backfills_history_on_open(tmp_path):
+    path = str(tmp_path / "bank.sqlite3")
+    _store_without_history(storage.SQLiteBackend(path), *OLD)
+    assert [v["divines"] for v in storage.SQLiteBackend(path).item_settings_history()] == [OLD[1]]
+    with sqlite3.connect(path) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM item_settings_history").fetchone()[0] == 1